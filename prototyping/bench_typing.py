@@ -0,0 +1,717 @@
+"""Benchmarks for the typing prototype.
+
+Run from this directory, e.g.::
+
+  python bench_typing.py                     # Run everything.
+  python bench_typing.py union tuple.        # Names starting with these.
+  python bench_typing.py --json run.json     # Also save the results.
+  python bench_typing.py --compare run.json  # Show changes against a run.
+  python bench_typing.py --list              # Only list the names.
+  python bench_typing.py import --import-budget 2  # Fail above 2 ms.
+  python bench_typing.py --memory            # Bytes per Tuple[...] etc.
+
+Each benchmark function below yields (name, func) pairs.  For each
+pair func() is called in a loop sized so that one repeat takes about
+--min-time seconds; after --warmup repeats that are thrown away,
+--repeat repeats are timed and summarized (median, mean, standard
+deviation and best time per call).  A func is timed right after it
+is yielded, so a benchmark can wrap a yield in a with-statement to
+time under e.g. a type variable binding.
+"""
+
+import argparse
+import importlib.util
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+import typing
+from typing import Any, TypeVar, T
+from typing import Union, Optional, Tuple, Callable, Generic
+from typing import compile_checker, typechecked, check_all
+
+
+class Employee:
+    pass
+
+
+class Manager(Employee):
+    pass
+
+
+def _classes(prefix, count, bases=()):
+    return [type('%s%d' % (prefix, i), bases, {}) for i in range(count)]
+
+
+def bench_import():
+    """Executing the body of typing.py in a fresh module.
+
+    This is what importing the module costs once its source is
+    compiled.  The .all variant also creates all lazy attributes, i.e.
+    what an eager definition of them would cost.
+    """
+    spec = importlib.util.spec_from_file_location('fresh_typing',
+                                                  typing.__file__)
+    code = spec.loader.get_code(spec.name)
+
+    def load():
+        module = importlib.util.module_from_spec(spec)
+        exec(code, module.__dict__)
+        return module
+
+    def load_all():
+        module = load()
+        for name in module._LAZY_TYPES:
+            getattr(module, name)
+
+    yield 'import.typing', load
+    yield 'import.typing.all', load_all
+
+
+def bench_any():
+    """Instance and subclass checks against Any."""
+    yield 'any.isinstance', lambda: isinstance(42, Any)
+    yield 'any.issubclass', lambda: issubclass(int, Any)
+
+
+def bench_typevar():
+    """Instance and subclass checks against type variables."""
+    S = TypeVar('S', str, bytes)
+    yield 'typevar.isinstance.unbound', lambda: isinstance(42, T)
+    yield 'typevar.isinstance.constrained', lambda: isinstance('', S)
+    yield 'typevar.issubclass.unbound', lambda: issubclass(int, T)
+    yield 'typevar.issubclass.constrained', lambda: issubclass(str, S)
+    with T.bind(int):
+        yield 'typevar.isinstance.bound', lambda: isinstance(42, T)
+        yield 'typevar.issubclass.bound', lambda: issubclass(int, T)
+
+    def bind_unbind():
+        with T.bind(int):
+            pass
+
+    yield 'typevar.bind', bind_unbind
+
+
+def bench_union():
+    """Construction and checks for unions of various widths."""
+    yield 'union.subscript.interned', lambda: Union[int, str]
+    yield 'union.optional.interned', lambda: Optional[Employee]
+    for width in (2, 8, 32):
+        classes = tuple(_classes('U', width))
+        u = Union[classes]
+        first, last = classes[0](), classes[-1]()
+
+        def build(classes=classes):
+            typing.type_cache_clear()
+            Union[classes]
+
+        yield 'union.subscript.new[%d]' % width, build
+        yield ('union.isinstance.first[%d]' % width,
+               lambda u=u, x=first: isinstance(x, u))
+        yield ('union.isinstance.last[%d]' % width,
+               lambda u=u, x=last: isinstance(x, u))
+        yield ('union.isinstance.miss[%d]' % width,
+               lambda u=u: isinstance(42, u))
+        yield ('union.issubclass[%d]' % width,
+               lambda u=u, c=classes[-1]: issubclass(c, u))
+    wide = Union[int, str, Tuple[int, str]]
+    yield 'union.isinstance.tuple_member', lambda: isinstance((1, ''), wide)
+
+
+def bench_union_prune():
+    """Union construction for growing numbers of plain classes.
+
+    Half of the classes derive from another member, so pruning has
+    real work to do.  The intern table is cleared before every
+    construction so that each call builds a new union.
+    """
+    for size in (10, 50, 100, 200, 500):
+        bases = _classes('B', size // 2)
+        derived = [type('D%d' % i, (b,), {}) for i, b in enumerate(bases)]
+        params = tuple(derived + bases)
+
+        def build(params=params):
+            typing.type_cache_clear()
+            Union[params]
+
+        yield 'union_prune[%d]' % size, build
+
+
+def bench_union_dispatch():
+    """Unions of message tuples told apart by length or by a tag class."""
+    tags = _classes('Tag', 8)
+    by_length = Union[tuple(Tuple[(tag,) + (int,) * n]
+                            for n, tag in enumerate(tags))]
+    by_tag = Union[tuple(Tuple[tag, str, int] for tag in tags)]
+    last = tags[-1]()
+    message = (last,) + (0,) * 7
+    tagged = (last, '', 0)
+    yield ('union_dispatch.length.match',
+           lambda: isinstance(message, by_length))
+    yield 'union_dispatch.tag.match', lambda: isinstance(tagged, by_tag)
+    yield ('union_dispatch.tag.miss',
+           lambda: isinstance((tags[0](), 0, 0), by_tag))
+    yield 'union_dispatch.union_match', lambda: typing.union_match(by_tag,
+                                                                   tagged)
+
+
+def bench_union_adaptive():
+    """A union of 8 Callable types whose last member gets 90% of matches."""
+    u = Union[tuple(Callable[[int] * n, int] for n in range(8))]
+
+    def first() -> int:
+        pass
+
+    def last(a: int, b: int, c: int, d: int, e: int, f: int, g: int) -> int:
+        pass
+
+    values = [last] * 9 + [first]
+
+    def check():
+        for value in values:
+            isinstance(value, u)
+
+    yield 'union_adaptive.off', check
+    typing.adaptive_unions(True)
+    try:
+        for _ in range(1000):
+            check()
+        yield 'union_adaptive.on', check
+    finally:
+        typing.adaptive_unions(False)
+
+
+def bench_subtype():
+    """issubclass() between nested typing constructs."""
+    KT = TypeVar('KT')
+    VT = TypeVar('VT')
+
+    class Model(Generic[KT, VT]):
+        pass
+
+    sup = Union[Tuple[Employee, Optional[str]], Callable[[int], str], bytes]
+    sub = Union[Tuple[Manager, str], bytes]
+    wide = Union[tuple(_classes('W', 20))]
+    S = TypeVar('S', int, str, bytes)
+
+    class Constrained(Generic[S]):
+        pass
+
+    yield 'subtype.union_of_tuples', lambda: issubclass(sub, sup)
+    yield 'subtype.union_of_tuples.miss', lambda: issubclass(sup, sub)
+    yield 'subtype.wide_union', lambda: issubclass(wide, wide)
+    yield ('subtype.tuple_nested',
+           lambda: issubclass(Tuple[Tuple[Manager], Manager],
+                              Tuple[Tuple[Employee], Employee]))
+    yield 'subtype.generic_substitute', lambda: Constrained[str]
+
+
+def bench_tuple():
+    """Construction and checks for Tuple."""
+    t = Tuple[int, str, Employee]
+    value = (42, '', Manager())
+
+    def build():
+        typing.type_cache_clear()
+        Tuple[int, str, Employee]
+
+    yield 'tuple.subscript.interned', lambda: Tuple[int, str, Employee]
+    yield 'tuple.subscript.new', build
+    yield 'tuple.isinstance.match', lambda: isinstance(value, t)
+    yield 'tuple.isinstance.mismatch', lambda: isinstance((42, '', 42), t)
+    yield 'tuple.isinstance.length', lambda: isinstance((42,), t)
+    yield 'tuple.issubclass', lambda: issubclass(Tuple[int, str, Manager], t)
+
+
+def bench_callable():
+    """Construction and checks for Callable."""
+    c = Callable[[int, str], Employee]
+
+    def func(a: int, b: str) -> Manager:
+        pass
+
+    class C:
+        def meth(self, a: int, b: str) -> Manager:
+            pass
+
+    method = C().meth
+
+    def build():
+        typing.type_cache_clear()
+        Callable[[int, str], Employee]
+
+    yield ('callable.subscript.interned',
+           lambda: Callable[[int, str], Employee])
+    yield 'callable.subscript.new', build
+    yield 'callable.isinstance.function', lambda: isinstance(func, c)
+    yield 'callable.isinstance.method', lambda: isinstance(method, c)
+    yield 'callable.isinstance.builtin', lambda: isinstance(len, c)
+    yield 'callable.issubclass', lambda: issubclass(c, Callable)
+
+
+def bench_generic():
+    """Generic subscription and class creation through GenericMeta."""
+    KT = TypeVar('KT')
+    VT = TypeVar('VT')
+
+    class Mapping(Generic[KT, VT]):
+        pass
+
+    class MyMapping(Mapping[str, int]):
+        pass
+
+    instance = MyMapping()
+
+    def build():
+        typing.type_cache_clear()
+        Mapping[str, int]
+
+    def define():
+        class Node(Generic[T]):
+            pass
+
+    def define_subclass():
+        class StrMapping(Mapping[str, VT]):
+            pass
+
+    yield 'generic.subscript.interned', lambda: Mapping[str, int]
+    yield 'generic.subscript.new', build
+    yield 'generic.new', define
+    yield 'generic.new.subclass', define_subclass
+    yield 'generic.isinstance', lambda: isinstance(instance, MyMapping)
+    yield 'generic.issubclass', lambda: issubclass(MyMapping, Mapping)
+
+
+def _generic_module_source(count, generic=True):
+    lines = ['from typing import Generic, TypeVar, T, KT, VT', '']
+    for i in range(count):
+        if not generic:
+            lines.append('class Model%d: pass' % i)
+        elif i % 2:
+            lines.append('class Model%d(Model%d[KT, VT]): pass' % (i, i - 1))
+        else:
+            lines.append('class Model%d(Generic[KT, VT]): pass' % i)
+    return compile('\n'.join(lines), '<models>', 'exec')
+
+
+def bench_generic_import():
+    """Executing a module body that defines N generic classes.
+
+    Half of the classes derive from Generic[KT, VT], the other half
+    from a subscription of the previous class, which is the usual
+    shape of a module of generic models.  The plain variant defines
+    N ordinary classes, for reference.
+    """
+    for count in (100, 500):
+        for generic in (True, False):
+            code = _generic_module_source(count, generic)
+
+            def execute(code=code):
+                exec(code, {'__name__': 'models'})
+
+            yield ('generic.import%s[%d]' % ('' if generic else '.plain',
+                                              count), execute)
+
+
+def bench_protocol():
+    """isinstance() against a protocol with five members.
+
+    The uncached variant clears the verdict cache before every check,
+    which is what walking the members on every check would cost.
+    """
+
+    class SupportsFile(typing.Protocol):
+        def read(self, n): pass
+        def write(self, data): pass
+        def seek(self, pos): pass
+        def close(self): pass
+        def fileno(self): pass
+
+    value = open(__file__)
+    value.close()
+
+    def uncached():
+        SupportsFile.__protocol_cache__.clear()
+        isinstance(value, SupportsFile)
+
+    yield 'protocol.isinstance.match', lambda: isinstance(value, SupportsFile)
+    yield 'protocol.isinstance.miss', lambda: isinstance(42, SupportsFile)
+    yield 'protocol.isinstance.uncached', uncached
+    yield 'protocol.issubclass', lambda: issubclass(type(value), SupportsFile)
+
+
+def bench_validation():
+    """isinstance() of a million-element list at each validation depth."""
+    values = list(range(1000000))
+    lst = typing.List[int]
+    for depth, count in (('shallow', None), ('first', 100),
+                         ('sample', 100), ('full', None)):
+
+        def check(depth=depth, count=count):
+            with typing.validation(depth, count, seed=0):
+                isinstance(values, lst)
+
+        yield 'validation.%s' % depth, check
+
+
+def bench_checker():
+    """isinstance() against a nested type vs. its compiled checker."""
+    tp = Tuple[Union[int, str], Optional[Employee]]
+    check = compile_checker(tp)
+    value = (42, Employee())
+    yield 'checker.isinstance', lambda: isinstance(value, tp)
+    yield 'checker.compiled', lambda: check(value)
+    yield 'checker.compile', lambda: compile_checker(tp)
+
+
+def bench_overload():
+    """Calls of an overloaded function with four variants."""
+
+    @typing.overload
+    def f(a: int, b: int):
+        return a
+
+    @typing.overload
+    def f(a: str, b: str):
+        return a
+
+    @typing.overload
+    def f(a: Employee, b: Union[int, str]):
+        return a
+
+    @typing.overload
+    def f(a: Tuple[int, int], b: int):
+        return a
+
+    def plain(a, b):
+        return a
+
+    manager = Manager()
+    yield 'overload.plain', lambda: plain(manager, 1)
+    yield 'overload.cached', lambda: f(manager, 1)
+    yield 'overload.uncached', lambda: f((1, 2), 3)
+    yield 'overload.keywords', lambda: f(manager, b=1)
+
+
+def _make_function(num_params):
+    params = ', '.join('a%d: int' % i for i in range(num_params))
+    namespace = {}
+    exec('def f(%s) -> int:\n    return a0' % params, namespace)
+    return namespace['f']
+
+
+def bench_typechecked():
+    """Call overhead of @typechecked for 1, 5 and 20 parameters."""
+    for num_params in (1, 5, 20):
+        func = _make_function(num_params)
+        checked = typechecked(func)
+        args = tuple(range(num_params))
+        yield ('typechecked.plain[%d]' % num_params,
+               lambda func=func, args=args: func(*args))
+        yield ('typechecked.checked[%d]' % num_params,
+               lambda func=checked, args=args: func(*args))
+
+
+def bench_batch():
+    """check_all() vs. an isinstance() loop over 100000 rows."""
+    row = Tuple[int, str, float]
+    rows = [(i, str(i), i / 2) for i in range(100000)]
+    ints = list(range(100000))
+    yield 'batch.isinstance_loop', lambda: all(isinstance(r, row)
+                                               for r in rows)
+    yield 'batch.check_all', lambda: check_all(row, rows)
+    yield 'batch.check_all.int', lambda: check_all(int, ints)
+
+
+def bench_forwardref():
+    """Checks through a forward reference vs. the class itself."""
+    direct = Union[int, Employee]
+    lazy = Union[int, 'Employee']
+    typing.resolve_forward_refs(__name__)
+    value = Manager()
+    yield 'forwardref.isinstance.direct', lambda: isinstance(value, direct)
+    yield 'forwardref.isinstance.resolved', lambda: isinstance(value, lazy)
+    yield ('forwardref.issubclass.resolved',
+           lambda: issubclass(Manager, lazy))
+
+
+def bench_compact():
+    """Construction and checks for compact Tuple and Callable aliases."""
+    previous = typing.compact_aliases(True)
+    try:
+        t = Tuple[int, str, Employee]
+        c = Callable[[int, str], Employee]
+    finally:
+        typing.compact_aliases(previous)
+    value = (42, '', Manager())
+
+    def func(a: int, b: str) -> Manager:
+        pass
+
+    def build():
+        typing.type_cache_clear()
+        typing.compact_aliases(True)
+        try:
+            Tuple[int, str, Employee]
+        finally:
+            typing.compact_aliases(previous)
+
+    yield 'compact.tuple.subscript.new', build
+    yield 'compact.tuple.isinstance.match', lambda: isinstance(value, t)
+    yield 'compact.callable.isinstance', lambda: isinstance(func, c)
+
+
+def bench_universe():
+    """Union algebra over 64 permission classes, bitwise vs. plain."""
+    perms = _classes('Perm', 64)
+    universe = typing.TypeUniverse(perms)
+    u1 = Union[tuple(perms[:40])]
+    u2 = Union[tuple(perms[20:])]
+    small = Union[tuple(perms[:10])]
+    for t in (u1, u2, small):
+        universe.bits(t)
+    universe.union(u1, u2)
+    universe.intersection(u1, u2)
+    yield 'universe.issubclass.plain', lambda: issubclass(small, u2)
+    yield ('universe.issubclass.bits',
+           lambda: universe.issubclass(small, u2))
+    yield 'universe.union.plain', lambda: Union[u1, u2]
+    yield 'universe.union.bits', lambda: universe.union(u1, u2)
+    yield 'universe.intersection.bits', lambda: universe.intersection(u1, u2)
+
+
+def bench_substitute():
+    """Specializing a nested template, cached and from scratch."""
+    KT = typing.KT
+    template = Tuple[T, Callable[[T], KT], Union[T, typing.List[KT]]]
+    mapping = {T: int, KT: str}
+
+    def fresh():
+        typing._substitutions.clear()
+        typing.substitute(template, mapping)
+
+    yield 'substitute.cached', lambda: typing.substitute(template, mapping)
+    yield 'substitute.new', fresh
+
+
+def bench_checked_container():
+    """Appending to a 10000-item list, re-checked vs. through a proxy."""
+    List = typing.List
+    plain = list(range(10000))
+    checked = typing.CheckedList(List[int], list(range(10000)))
+
+    def recheck():
+        plain.append(1)
+        isinstance(plain, List[int])
+        plain.pop()
+
+    def proxy():
+        checked.append(1)
+        checked.pop()
+
+    yield 'checked_container.recheck', recheck
+    yield 'checked_container.append', proxy
+
+
+def bench_validate():
+    """isinstance() vs. validate() on a JSON document with shared parts."""
+    global JSON
+    JSON = Union[int, str, typing.List['JSON'], typing.Dict[str, 'JSON']]
+    row = {'id': 1, 'tags': ['a', 'b'], 'score': 3}
+    doc = {'rows': [row] * 100, 'meta': {'rows': [row] * 100}}
+    nested = [1]
+    for _ in range(10):
+        nested = [nested, nested]
+    yield 'validate.json.isinstance', lambda: isinstance(doc, JSON)
+    yield 'validate.json.validate', lambda: typing.validate(JSON, doc)
+    yield 'validate.dag.isinstance', lambda: isinstance(nested, JSON)
+    yield 'validate.dag.validate', lambda: typing.validate(JSON, nested)
+
+
+def bench_checked_iter():
+    """Consuming 100000 rows through checked_iter() vs. a plain iterator."""
+    rows = [(i, str(i)) for i in range(100000)]
+    typ = typing.Iterator[Tuple[int, str]]
+    yield 'checked_iter.plain', lambda: sum(1 for _ in iter(rows))
+    for every in (1, 10, 100):
+        yield ('checked_iter.every[%d]' % every,
+               lambda every=every: sum(1 for _ in typing.checked_iter(
+                   typ, rows, every=every)))
+
+
+BENCHMARKS = [
+    bench_import,
+    bench_any,
+    bench_typevar,
+    bench_union,
+    bench_union_prune,
+    bench_union_dispatch,
+    bench_union_adaptive,
+    bench_universe,
+    bench_subtype,
+    bench_tuple,
+    bench_callable,
+    bench_generic,
+    bench_generic_import,
+    bench_substitute,
+    bench_protocol,
+    bench_compact,
+    bench_validation,
+    bench_checker,
+    bench_typechecked,
+    bench_overload,
+    bench_batch,
+    bench_checked_iter,
+    bench_checked_container,
+    bench_validate,
+    bench_forwardref,
+]
+
+
+# Median seconds that importing typing may take; see --import-budget.
+IMPORT_BUDGET = 0.001
+
+
+def memory_usage(count=2000):
+    """Return the bytes allocated per Tuple and Callable parameterization.
+
+    The result maps 'class' and 'compact' to the average size of
+    Tuple[C, int] and Callable[[C], int] over count fresh classes C,
+    measured with tracemalloc, including the intern table entries.
+    """
+    results = {}
+    for mode in ('class', 'compact'):
+        previous = typing.compact_aliases(mode == 'compact')
+        try:
+            classes = _classes('M', count)
+            typing.type_cache_clear()
+            tracemalloc.start()
+            try:
+                kept = ([Tuple[c, int] for c in classes] +
+                        [Callable[[c], int] for c in classes])
+                results[mode] = tracemalloc.get_traced_memory()[0] / len(kept)
+            finally:
+                tracemalloc.stop()
+        finally:
+            typing.compact_aliases(previous)
+        del kept
+        typing.type_cache_clear()
+    return results
+
+
+def _calibrate(func, min_time):
+    """Return a loop count for which func() takes about min_time."""
+    number = 1
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - t0
+        if elapsed >= min_time:
+            return number
+        number *= 10 if elapsed < min_time / 10 else 2
+
+
+def measure(func, repeat, warmup, min_time):
+    """Time func() and return a dict of statistics in seconds per call."""
+    number = _calibrate(func, min_time)
+    timings = []
+    for i in range(warmup + repeat):
+        t0 = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = (time.perf_counter() - t0) / number
+        if i >= warmup:
+            timings.append(elapsed)
+    return {
+        'median': statistics.median(timings),
+        'mean': statistics.mean(timings),
+        'stdev': statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        'min': min(timings),
+        'number': number,
+        'repeat': repeat,
+    }
+
+
+def run(selected, repeat, warmup, min_time, out=sys.stdout):
+    results = {}
+    for bench in BENCHMARKS:
+        for name, func in bench():
+            if selected and not any(name.startswith(s) for s in selected):
+                continue
+            stats = measure(func, repeat, warmup, min_time)
+            results[name] = stats
+            print('%-40s %12.3f us +- %5.1f%%' % (
+                name, stats['median'] * 1e6,
+                100 * stats['stdev'] / stats['mean']), file=out)
+            out.flush()
+    return results
+
+
+def compare(results, baseline, out=sys.stdout):
+    print(file=out)
+    print('%-40s %12s %12s %8s' % ('benchmark', 'baseline', 'now', 'change'),
+          file=out)
+    for name, stats in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]['median']
+        new = stats['median']
+        print('%-40s %9.3f us %9.3f us %+7.1f%%' % (
+            name, old * 1e6, new * 1e6, 100 * (new - old) / old), file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the typing prototype.")
+    parser.add_argument('names', nargs='*',
+                        help="only run benchmarks whose names start "
+                             "with one of these")
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--min-time', type=float, default=0.02,
+                        help="approximate seconds per repeat")
+    parser.add_argument('--json', metavar='FILE',
+                        help="write the results to FILE as JSON")
+    parser.add_argument('--compare', metavar='FILE',
+                        help="compare with results saved with --json")
+    parser.add_argument('--list', action='store_true',
+                        help="list the benchmark names and exit")
+    parser.add_argument('--memory', action='store_true',
+                        help="measure memory per parameterization and exit")
+    parser.add_argument('--import-budget', metavar='MS', type=float,
+                        default=IMPORT_BUDGET * 1e3,
+                        help="fail if import.typing takes longer than "
+                             "this (default %(default)s)")
+    args = parser.parse_args(argv)
+    if args.list:
+        for bench in BENCHMARKS:
+            for name, func in bench():
+                print(name)
+        return
+    if args.memory:
+        for mode, size in memory_usage().items():
+            print('%-40s %9.0f bytes' % ('memory.parameterization.' + mode,
+                                        size))
+        return
+    results = run(args.names, args.repeat, args.warmup, args.min_time)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'implementation': platform.python_implementation(),
+                       'benchmarks': results}, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)['benchmarks'])
+    if 'import.typing' in results:
+        median = results['import.typing']['median']
+        if median * 1e3 > args.import_budget:
+            sys.exit("import.typing took %.3f ms, over the budget of "
+                     "%.3f ms" % (median * 1e3, args.import_budget))
+
+
+if __name__ == '__main__':
+    main()
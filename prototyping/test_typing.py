@@ -1,13 +1,40 @@
+import abc
+import gc
+import importlib.util
+import inspect
+import io
+import json
+import re
+import sys
+import types
+import weakref
 from unittest import TestCase, mock
 
+import typing
 from typing import Any
 from typing import TypeVar, T, KT, VT, AnyStr
-from typing import Union, Optional
-from typing import Tuple
-from typing import Callable
-from typing import Generic
+from typing import Union, Optional, UnionMeta
+from typing import Tuple, TupleMeta
+from typing import Callable, CallableMeta
+from typing import Generic, GenericMeta
+from typing import Protocol
 from typing import Undefined
-from typing import cast
+from typing import cast, overload, substitute
+from typing import TypeUniverse
+from typing import type_cache_info, type_cache_clear
+from typing import subtype_cache_info, subtype_cache_clear
+from typing import compile_checker
+from typing import typechecked
+from typing import check_all, first_violation
+from typing import checked_iter, validate
+from typing import CheckedList, CheckedDict, CheckedSet
+from typing import enable_instrumentation, disable_instrumentation
+from typing import reset_instrumentation, instrumentation_report
+from typing import forwardref, resolve_forward_refs
+from typing import compact_aliases
+from typing import adaptive_unions, union_hits, union_match
+from typing import set_validation, validation
+from typing import Iterable
 
 
 class Employee:
@@ -170,6 +197,89 @@ class TypeVarTests(TestCase):
         self.assertNotIsInstance(42, T)
 
 
+class TypeVarContextTests(TestCase):
+
+    def test_threads(self):
+        import threading
+        types = [int, float, str, bytes, Employee, Manager, list, dict]
+        barrier = threading.Barrier(len(types))
+        errors = []
+
+        def worker(t):
+            with T.bind(t):
+                barrier.wait()
+                for _ in range(200):
+                    if T.__binding__ is not t or not issubclass(t, T):
+                        errors.append(t)
+                barrier.wait()
+            if T.__binding__ is not None:
+                errors.append(t)
+
+        threads = [threading.Thread(target=worker, args=(t,))
+                   for t in types]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        self.assertEqual(errors, [])
+        self.assertIsNone(T.__binding__)
+
+    def test_shared_binding_across_threads(self):
+        import threading
+        bv = T.bind(int)
+        inside = threading.Event()
+        done = threading.Event()
+        seen = []
+
+        def worker():
+            with bv:
+                inside.set()
+                done.wait()
+                seen.append(T.__binding__)
+
+        th = threading.Thread(target=worker)
+        th.start()
+        inside.wait()
+        self.assertIsNone(T.__binding__)
+        with bv:  # Not a recursive reuse in this thread.
+            self.assertIs(T.__binding__, int)
+        done.set()
+        th.join()
+        self.assertEqual(seen, [int])
+
+    def test_tasks(self):
+        import asyncio
+        types = [int, float, str, bytes] * 25
+        errors = []
+
+        async def task(t):
+            with T.bind(t):
+                for _ in range(5):
+                    await asyncio.sleep(0)
+                    if T.__binding__ is not t:
+                        errors.append(t)
+            if T.__binding__ is not None:
+                errors.append(t)
+
+        async def main():
+            await asyncio.gather(*[task(t) for t in types])
+
+        asyncio.run(main())
+        self.assertEqual(errors, [])
+
+    def test_task_inherits(self):
+        import asyncio
+
+        async def check():
+            return isinstance(42, T)
+
+        async def main():
+            with T.bind(int):
+                return await asyncio.create_task(check())
+
+        self.assertTrue(asyncio.run(main()))
+
+
 class UnionTests(TestCase):
 
     def test_basics(self):
@@ -279,6 +389,116 @@ class UnionTests(TestCase):
         with self.assertRaises(TypeError):
             Union[()]
 
+    def test_wide_union_pruning(self):
+        # Compare against the straightforward pairwise algorithm.
+        import abc
+        import random
+
+        class Root(metaclass=abc.ABCMeta):
+            pass
+
+        classes = [Root]
+        rnd = random.Random(42)
+        for i in range(200):
+            bases = tuple(rnd.sample(classes, min(len(classes),
+                                                  rnd.randint(1, 2))))
+            try:
+                classes.append(type('C%d' % i, bases, {}))
+            except TypeError:
+                continue  # Inconsistent MRO.
+        classes.append(int)
+        Root.register(int)
+
+        def expected(params):
+            all_params = set(params)
+            for t1 in params:
+                if any(issubclass(t1, t2) for t2 in all_params - {t1}):
+                    all_params.remove(t1)
+            return [t for t in params if t in all_params]
+
+        for _ in range(20):
+            params = rnd.sample(classes[1:], 50)
+            u = Union[tuple(params)]
+            got = getattr(u, '__union_params__', (u,))
+            self.assertEqual(list(got), expected(params))
+        u = Union[tuple(classes)]
+        self.assertIs(u, Root)
+        self.assertIs(Union[tuple(classes) + (object,)], object)
+        self.assertIs(Union[(object,) + tuple(classes)], object)
+
+
+class UnionCacheTests(TestCase):
+
+    def test_repeated(self):
+        u = Union[int, Employee]
+        for _ in range(3):
+            self.assertIsInstance(42, u)
+            self.assertIsInstance(Manager(), u)
+            self.assertNotIsInstance('', u)
+        self.assertIn(Manager, u.__union_cache__)
+
+    def test_equal_classes(self):
+
+        def make():
+            class Box(Generic[T]):
+                pass
+            return Box
+
+        A, B = make(), make()
+        self.assertEqual(A, B)
+        u = Union[int, A]
+        self.assertIsInstance(A(), u)
+        self.assertNotIsInstance(B(), u)
+
+    def test_abc_register(self):
+        import abc
+
+        class Base(metaclass=abc.ABCMeta):
+            pass
+
+        class Other:
+            pass
+
+        u = Union[int, Base]
+        self.assertNotIsInstance(Other(), u)
+        Base.register(Other)
+        self.assertIsInstance(Other(), u)
+
+    def test_bound_var(self):
+        u = Union[str, T]
+        self.assertNotIsInstance(42, u)
+        with T.bind(int):
+            self.assertIsInstance(42, u)
+        self.assertNotIsInstance(42, u)
+
+    def test_constrained_var(self):
+        u = Union[float, AnyStr]
+        self.assertIsInstance('', u)
+        self.assertIsInstance(b'', u)
+        with AnyStr.bind(str):
+            self.assertIsInstance('', u)
+            self.assertNotIsInstance(b'', u)
+        self.assertIsInstance(b'', u)
+
+    def test_value_dependent(self):
+        u = Union[int, Tuple[int, str]]
+        self.assertIsInstance((1, ''), u)
+        self.assertNotIsInstance((1, 1), u)
+        self.assertIsInstance((2, 'x'), u)
+
+    def test_class_override(self):
+
+        class Proxy:
+            __class__ = Employee
+
+        u = Union[int, Employee]
+        self.assertIsInstance(Proxy(), u)
+        self.assertNotIsInstance(Proxy, u)
+
+    def test_unsubscripted(self):
+        with self.assertRaises(TypeError):
+            isinstance(42, Union)
+
 
 class TypeVarUnionTests(TestCase):
 
@@ -386,6 +606,128 @@ class TupleTests(TestCase):
             issubclass(42, Tuple[int])
 
 
+class CompactAliasTests(TestCase):
+
+    def setUp(self):
+        self.previous = compact_aliases(True)
+
+    def tearDown(self):
+        compact_aliases(self.previous)
+
+    def test_toggle(self):
+        self.assertIs(compact_aliases(False), True)
+        self.assertIsInstance(Tuple[Employee, Manager], TupleMeta)
+        self.assertIs(compact_aliases(True), False)
+        self.assertNotIsInstance(Tuple[Employee, Manager], type)
+
+    def test_tuple(self):
+        t = Tuple[int, Employee]
+        self.assertNotIsInstance(t, type)
+        self.assertIs(t.__origin__, Tuple)
+        self.assertEqual(t.__tuple_params__, (int, Employee))
+        self.assertIs(Tuple[int, Employee], t)
+        self.assertEqual(repr(t), 'typing.Tuple[int, %s.Employee]' % __name__)
+        self.assertIsInstance((42, Manager()), t)
+        self.assertNotIsInstance((42, 42), t)
+        self.assertNotIsInstance((42,), t)
+        self.assertTrue(issubclass(tuple, t))
+        self.assertTrue(issubclass(Tuple[int, Manager], t))
+        self.assertFalse(issubclass(Tuple[int, object], t))
+        self.assertTrue(issubclass(t, Tuple))
+        self.assertTrue(issubclass(t, object))
+        self.assertFalse(issubclass(t, int))
+        with self.assertRaises(TypeError):
+            issubclass(42, t)
+
+    def test_callable(self):
+        c = Callable[[int], Employee]
+        self.assertNotIsInstance(c, type)
+        self.assertIs(Callable[[int], Employee], c)
+        self.assertEqual(repr(c),
+                         'typing.Callable[[int], %s.Employee]' % __name__)
+
+        def f(a: int) -> Manager:
+            pass
+
+        self.assertIsInstance(f, c)
+        self.assertNotIsInstance(42, c)
+        self.assertTrue(issubclass(c, Callable))
+        self.assertTrue(issubclass(c, c))
+        self.assertFalse(issubclass(Callable[[str], Employee], c))
+        self.assertFalse(issubclass(int, c))
+
+    def test_callable_equality(self):
+        c = Callable[[Union[int, str]], Employee]
+        d = Callable[[Union[str, int]], Employee]
+        self.assertIsNot(c, d)
+        self.assertEqual(c, d)
+        self.assertEqual(hash(c), hash(d))
+        self.assertTrue(issubclass(c, d))
+        self.assertIs(Union[c, d], c)
+        self.assertNotEqual(c, Callable[[int], Employee])
+        compact_aliases(False)
+        e = Callable[[Union[str, int]], Employee]
+        self.assertIsInstance(e, CallableMeta)
+        self.assertEqual(c, e)
+        self.assertEqual(e, c)
+        self.assertEqual(hash(c), hash(e))
+        self.assertTrue(issubclass(c, e))
+        self.assertTrue(issubclass(e, c))
+
+    def test_nested(self):
+        u = Union[Tuple[int, str], Callable[[int], int], Iterable, None]
+        self.assertEqual(len(u.__union_params__), 4)
+        self.assertIsInstance((1, ''), u)
+        self.assertIsInstance(None, u)
+        self.assertIsInstance((1, 1), u)  # Iterable.
+        self.assertNotIsInstance(42, u)
+        self.assertIs(Union[Tuple[int], object], object)
+        self.assertIs(Union[Tuple[int], Any], Any)
+        self.assertTrue(issubclass(Tuple[int], Any))
+        t = Tuple[Tuple[int], Optional[str]]
+        self.assertIsInstance(((1,), None), t)
+        self.assertTrue(issubclass(Tuple[Tuple[bool], str], t))
+
+    def test_optional(self):
+        o = Optional[Tuple[int]]
+        self.assertEqual(o, Union[Tuple[int], None])
+        self.assertIsInstance((1,), o)
+        self.assertIsInstance(None, o)
+        self.assertNotIsInstance(('',), o)
+        self.assertIs(Optional[Callable[[int], int]].__union_params__[1],
+                      type(None))
+
+        @typechecked
+        def f(a: Tuple[int] = None):
+            return a
+
+        self.assertIsNone(f())
+        self.assertEqual(f((1,)), (1,))
+        with self.assertRaises(TypeError):
+            f(('',))
+
+    def test_checks(self):
+        t = Tuple[int, Union[str, Tuple[int]]]
+        self.assertTrue(compile_checker(t)((1, (2,))))
+        self.assertFalse(compile_checker(t)((1, (2, 3))))
+        self.assertEqual(first_violation(t, [(1, ''), (1, 1)]), (1, (1, 1)))
+
+        @typechecked
+        def f(a: Tuple[int, int]) -> int:
+            return a[0]
+
+        self.assertEqual(f((1, 2)), 1)
+        with self.assertRaises(TypeError):
+            f((1, ''))
+
+    def test_smaller(self):
+        sizes = {}
+        for compact in (False, True):
+            compact_aliases(compact)
+            sizes[compact] = sys.getsizeof(Tuple[int, Manager])
+        self.assertLess(sizes[True], sizes[False])
+
+
 class CallableTests(TestCase):
 
     def test_basics(self):
@@ -507,6 +849,46 @@ class CallableTests(TestCase):
         self.assertIsInstance(C.smethod, ct)
         self.assertIsInstance(C.imethod, Callable[[Any, int], int])
 
+    def test_signature_cached(self):
+        c = Callable[[int], int]
+
+        def flub(a: int) -> int:
+            return a
+
+        class C:
+            def meth(self, a: int) -> int:
+                return a
+
+        with mock.patch('inspect.getfullargspec',
+                        wraps=inspect.getfullargspec) as spec:
+            for _ in range(3):
+                self.assertIsInstance(flub, c)
+                self.assertIsInstance(C().meth, c)
+            self.assertEqual(spec.call_count, 2)
+
+    def test_signature_changed(self):
+        c = Callable[[int], int]
+
+        def flub(a: int) -> int:
+            return a
+
+        self.assertIsInstance(flub, c)
+        flub.__annotations__ = {'a': str}
+        self.assertNotIsInstance(flub, c)
+        flub.__annotations__ = {}
+        flub.__defaults__ = (1,)
+        self.assertIsInstance(flub, Callable[[], int])
+
+    def test_bad_annotation(self):
+
+        def flub(a: 42) -> int:
+            return 0
+
+        with self.assertRaises(TypeError):
+            isinstance(flub, Callable[[int], int])
+        with self.assertRaises(TypeError):
+            isinstance(flub, Callable[[int], int])
+
     def test_cannot_subclass(self):
         with self.assertRaises(TypeError):
 
@@ -629,6 +1011,1505 @@ class GenericTests(TestCase):
         assert A[T] != B[T]
 
 
+class ProtocolTests(TestCase):
+
+    def test_basics(self):
+
+        class SupportsClose(Protocol):
+            def close(self):
+                pass
+
+        class Closer:
+            def close(self):
+                pass
+
+        self.assertIsInstance(Closer(), SupportsClose)
+        self.assertIsInstance(io.StringIO(), SupportsClose)
+        self.assertNotIsInstance(42, SupportsClose)
+        self.assertTrue(issubclass(Closer, SupportsClose))
+        self.assertFalse(issubclass(int, SupportsClose))
+        self.assertEqual(SupportsClose.__protocol_members__,
+                         (('close', True),))
+
+    def test_members(self):
+
+        class Named(Protocol):
+            name = ''
+
+        class Both(Named, Protocol):
+            def greet(self):
+                pass
+
+        class NotCallable:
+            name = 'x'
+            greet = 42
+
+        class Disabled:
+            name = None
+
+            def greet(self):
+                pass
+
+        class Good:
+            name = 'x'
+
+            def greet(self):
+                pass
+
+        self.assertEqual(Both.__protocol_members__,
+                         (('greet', True), ('name', False)))
+        self.assertNotIsInstance(NotCallable(), Both)
+        self.assertNotIsInstance(Disabled(), Both)
+        self.assertIsInstance(Good(), Both)
+        self.assertIsInstance(Good(), Named)
+
+    def test_generic(self):
+
+        class SupportsAbs(Protocol[T]):
+            def __abs__(self):
+                pass
+
+        self.assertEqual(SupportsAbs.__parameters__, (T,))
+        self.assertIsInstance(-1, SupportsAbs)
+        self.assertIsInstance(-1, SupportsAbs[int])
+        self.assertNotIsInstance('', SupportsAbs)
+
+    def test_explicit_subclass_is_not_protocol(self):
+
+        class SupportsClose(Protocol):
+            def close(self):
+                pass
+
+        class Closer(SupportsClose):
+            pass
+
+        self.assertIsNone(Closer.__protocol_members__)
+        self.assertIsInstance(Closer(), SupportsClose)
+        self.assertNotIsInstance(io.StringIO(), Closer)
+
+    def test_equal_classes(self):
+
+        class SupportsClose(Protocol):
+            def close(self):
+                pass
+
+        def make(closeable):
+            class Box(Generic[T]):
+                if closeable:
+                    def close(self):
+                        pass
+            return Box
+
+        A, B = make(True), make(False)
+        self.assertEqual(A, B)
+        self.assertIsInstance(A(), SupportsClose)
+        self.assertNotIsInstance(B(), SupportsClose)
+
+    def test_bad_base(self):
+        with self.assertRaises(TypeError):
+            class P(int, Protocol):
+                pass
+
+    def test_cached(self):
+
+        class SupportsClose(Protocol):
+            def close(self):
+                pass
+
+        class Closer:
+            def close(self):
+                pass
+
+        self.assertIsInstance(Closer(), SupportsClose)
+        self.assertNotIsInstance(42, SupportsClose)
+        self.assertIs(SupportsClose.__protocol_cache__[Closer], True)
+        self.assertIs(SupportsClose.__protocol_cache__[int], False)
+        with mock.patch('typing._conforms') as conforms:
+            self.assertIsInstance(Closer(), SupportsClose)
+            self.assertNotIsInstance(42, SupportsClose)
+            conforms.assert_not_called()
+        del Closer
+        gc.collect()
+        self.assertEqual(len(SupportsClose.__protocol_cache__), 1)
+
+    def test_abc_registration(self):
+
+        class SupportsClose(Protocol):
+            def close(self):
+                pass
+
+        class C:
+            pass
+
+        self.assertNotIsInstance(C(), SupportsClose)
+        SupportsClose.register(C)
+        self.assertIsInstance(C(), SupportsClose)
+
+    def test_union(self):
+
+        class SupportsClose(Protocol):
+            def close(self):
+                pass
+
+        u = Union[int, SupportsClose]
+        self.assertIn(SupportsClose, u.__union_cached_params__)
+        self.assertIsInstance(io.StringIO(), u)
+        self.assertNotIsInstance('', u)
+
+
+class CollectionsTests(TestCase):
+
+    def fresh_typing(self):
+        spec = importlib.util.spec_from_file_location('fresh_typing',
+                                                      typing.__file__)
+        mod = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(mod)
+        return mod
+
+    def test_lazy(self):
+        mod = self.fresh_typing()
+        self.assertNotIn('List', vars(mod))
+        self.assertIn('List', dir(mod))
+        self.assertIn('List', mod.__all__)
+        lst = mod.List
+        self.assertIn('List', vars(mod))
+        self.assertIn('MutableSequence', vars(mod))
+        self.assertNotIn('Dict', vars(mod))
+        self.assertIs(mod.List, lst)
+        with self.assertRaises(AttributeError):
+            mod.NoSuchName
+
+    def test_all(self):
+        for name in typing.__all__:
+            self.assertTrue(hasattr(typing, name), name)
+
+    def test_list(self):
+        self.assertIsInstance([], typing.List)
+        self.assertIsInstance([], typing.List[int])
+        self.assertNotIsInstance((), typing.List)
+        self.assertTrue(issubclass(list, typing.List))
+        self.assertTrue(issubclass(typing.List, typing.MutableSequence))
+        self.assertTrue(issubclass(typing.List[int], typing.Sequence))
+        self.assertEqual(repr(typing.List[int]), 'typing.List[int]')
+
+    def test_dict_and_sets(self):
+        self.assertIsInstance({}, typing.Dict[str, int])
+        self.assertIsInstance({}, typing.MutableMapping)
+        self.assertIsInstance(set(), typing.Set)
+        self.assertIsInstance(frozenset(), typing.FrozenSet)
+        self.assertIsInstance(frozenset(), typing.AbstractSet)
+        self.assertNotIsInstance(frozenset(), typing.MutableSet)
+        self.assertEqual(typing.Dict.__parameters__, (KT, VT))
+
+    def test_abcs(self):
+        self.assertIsInstance(iter([]), typing.Iterator[int])
+        self.assertIsInstance((), typing.Sequence)
+        self.assertIsInstance(b'', typing.ByteString)
+        self.assertIsInstance({}.items(), typing.ItemsView)
+        self.assertIsInstance({}.keys(), typing.KeysView)
+        self.assertIsInstance(42, typing.Hashable)
+        self.assertNotIsInstance([], typing.Hashable)
+        self.assertEqual(typing.ItemsView.__parameters__, (KT, VT))
+
+        class MyIterable(typing.Iterable[int]):
+            def __iter__(self):
+                return iter([])
+
+        self.assertIsInstance(MyIterable(), typing.Iterable)
+        # The extra class is not inherited by subclasses.
+        self.assertFalse(issubclass(list, MyIterable))
+
+    def test_io_and_re(self):
+        self.assertIsInstance(io.StringIO(), typing.TextIO)
+        self.assertIsInstance(io.BytesIO(), typing.BinaryIO)
+        self.assertIsInstance(io.BytesIO(), typing.IO[bytes])
+        self.assertNotIsInstance(io.StringIO(), typing.BinaryIO)
+        self.assertIsInstance(re.compile(''), typing.Pattern[str])
+        self.assertIsInstance(re.match('', ''), typing.Match)
+        with self.assertRaises(TypeError):
+            typing.Pattern[int]
+
+
+class ValidationTests(TestCase):
+
+    def setUp(self):
+        self.previous = set_validation('full')
+
+    def tearDown(self):
+        set_validation(*self.previous)
+
+    def test_elements(self):
+        self.assertIsInstance([1, 2], typing.List[int])
+        self.assertNotIsInstance([1, ''], typing.List[int])
+        self.assertIsInstance([1, ''], typing.List)
+        self.assertIsInstance([1, ''], typing.List[Any])
+        self.assertIsInstance({1: ''}, typing.Dict[int, str])
+        self.assertNotIsInstance({1: 1}, typing.Dict[int, str])
+        self.assertNotIsInstance({'': ''}, typing.Dict[int, str])
+        self.assertIsInstance({1: 1}, typing.Dict[int, VT])
+        self.assertIsInstance({1, 2}, typing.Set[int])
+        self.assertNotIsInstance(frozenset(['']), typing.FrozenSet[int])
+        self.assertIsInstance([(1, '')], typing.List[Tuple[int, str]])
+        # Only the concrete collections look at elements.
+        self.assertIsInstance([''], typing.Sequence[int])
+
+    def test_type_vars(self):
+        self.assertIsInstance([''], typing.List[T])
+        with T.bind(int):
+            self.assertNotIsInstance([''], typing.List[T])
+            self.assertIsInstance([1], typing.List[T])
+
+    def test_not_type_determined(self):
+        u = Union[typing.List[int], str]
+        self.assertIsInstance([1], u)
+        self.assertNotIsInstance([''], u)
+        self.assertIsInstance([1], u)
+
+    def test_shallow(self):
+        set_validation('shallow')
+        self.assertIsInstance([''], typing.List[int])
+        self.assertIsInstance((1, 1), Tuple[int, str])
+        self.assertNotIsInstance((1,), Tuple[int, str])
+        self.assertNotIsInstance((), typing.List[int])
+
+    def test_first(self):
+        set_validation('first', 2)
+        self.assertIsInstance([1, 2, ''], typing.List[int])
+        self.assertNotIsInstance([1, ''], typing.List[int])
+        self.assertIsInstance({1: 1, 2: 2, 3: ''}, typing.Dict[int, int])
+        self.assertIsInstance((1, 2, ''), Tuple[int, int, int])
+
+    def test_sample(self):
+        values = list(range(100)) + ['']
+        set_validation('sample', 10, seed=1)
+        first = [isinstance(values, typing.List[int]) for _ in range(50)]
+        self.assertIn(False, first)
+        self.assertIn(True, first)
+        set_validation('sample', 10, seed=1)
+        again = [isinstance(values, typing.List[int]) for _ in range(50)]
+        self.assertEqual(again, first)
+        # Everything is checked when there are no more than count.
+        self.assertNotIsInstance([1, ''], typing.List[int])
+
+    def test_sample_looks_at_count_elements(self):
+        set_validation('sample', 3, seed=0)
+        values = [0] * 100
+        with mock.patch.object(typing.TypeVar, '__instancecheck__',
+                               return_value=True) as check:
+            isinstance(values, typing.List[AnyStr])
+        self.assertEqual(check.call_count, 3)
+
+    def test_local(self):
+        set_validation('shallow')
+        with validation('full'):
+            self.assertNotIsInstance([''], typing.List[int])
+            with validation('shallow'):
+                self.assertIsInstance([''], typing.List[int])
+        self.assertIsInstance([''], typing.List[int])
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            set_validation('deep')
+        with self.assertRaises(ValueError):
+            set_validation('first')
+        with self.assertRaises(ValueError):
+            validation('sample', -1).__enter__()
+        self.assertEqual(set_validation('full'), ('full', None, None))
+
+
+class TypeCacheTests(TestCase):
+
+    def test_identity(self):
+        self.assertIs(Union[int, str], Union[int, str])
+        self.assertIs(Optional[int], Optional[int])
+        self.assertIs(Tuple[int, str], Tuple[int, str])
+        self.assertIs(Callable[[int], str], Callable[[int], str])
+        self.assertIs(SimpleMapping[str, int], SimpleMapping[str, int])
+        self.assertIs(Generic[T], Generic[T])
+
+    def test_distinct(self):
+        self.assertIsNot(Tuple[int, str], Tuple[str, int])
+        self.assertIsNot(Callable[[int, str], int], Callable[[int], str])
+        # Equal, but spelled differently.
+        self.assertEqual(Union[int, str], Union[str, int])
+        self.assertEqual(repr(Union[str, int]), 'typing.Union[str, int]')
+
+    def test_same_name_generics(self):
+
+        def make(value):
+            class A(Generic[T]):
+                x = value
+            return A
+
+        a1, a2 = make(1), make(2)
+        self.assertEqual(a1, a2)  # Generic equality only compares names.
+        self.assertEqual(a1[int].x, 1)
+        self.assertEqual(a2[int].x, 2)
+
+    def test_info(self):
+        type_cache_clear()
+        self.assertEqual(tuple(type_cache_info()), (0, 0, 0))
+        u = Union[int, Employee]
+        self.assertEqual(type_cache_info().misses, 1)
+        self.assertIs(Union[int, Employee], u)
+        self.assertEqual(type_cache_info().hits, 1)
+        self.assertEqual(type_cache_info().currsize, 1)
+
+    def test_collected(self):
+        type_cache_clear()
+
+        class Temp:
+            pass
+
+        Tuple[Temp, int]
+        self.assertEqual(type_cache_info().currsize, 1)
+        del Temp
+        gc.collect()
+        self.assertEqual(type_cache_info().currsize, 0)
+
+    def test_errors_not_cached(self):
+        with self.assertRaises(TypeError):
+            Union[42]
+        with self.assertRaises(TypeError):
+            Union[42]
+
+
+class SubtypeCacheTests(TestCase):
+
+    def setUp(self):
+        subtype_cache_clear()
+
+    def test_cached(self):
+        u = Union[Tuple[Employee, int], str]
+        self.assertTrue(issubclass(Tuple[Manager, int], u))
+        info = subtype_cache_info()
+        self.assertGreater(info.misses, 0)
+        hits = info.hits
+        self.assertTrue(issubclass(Tuple[Manager, int], u))
+        self.assertEqual(subtype_cache_info().hits, hits + 1)
+        self.assertFalse(issubclass(Tuple[Manager, str], u))
+        self.assertFalse(issubclass(Tuple[Manager, str], u))
+
+    def test_abc_registration(self):
+
+        class A(abc.ABC):
+            pass
+
+        class B:
+            pass
+
+        u = Union[A, str]
+        self.assertFalse(issubclass(B, u))
+        A.register(B)
+        self.assertTrue(issubclass(B, u))
+
+    def test_bound_type_vars(self):
+        u = Union[T, str]
+        self.assertFalse(issubclass(int, u))
+        with T.bind(int):
+            self.assertTrue(issubclass(int, u))
+            size = subtype_cache_info().currsize
+            self.assertTrue(issubclass(Tuple[int], Tuple[T]))
+            self.assertEqual(subtype_cache_info().currsize, size)
+        self.assertFalse(issubclass(int, u))
+        self.assertFalse(issubclass(Tuple[int], Tuple[T]))
+
+    def test_bounded(self):
+        classes = [type('C%d' % i, (), {}) for i in range(20)]
+        with mock.patch.object(typing._subtype_cache, 'maxsize', 10):
+            for c in classes:
+                issubclass(c, Union[int, str])
+            self.assertEqual(subtype_cache_info().currsize, 10)
+            # The most recent ones are kept.
+            hits = subtype_cache_info().hits
+            issubclass(classes[-1], Union[int, str])
+            self.assertEqual(subtype_cache_info().hits, hits + 1)
+            issubclass(classes[0], Union[int, str])
+            self.assertEqual(subtype_cache_info().hits, hits + 1)
+
+    def test_threads(self):
+        import threading
+        classes = [type('C%d' % i, (), {}) for i in range(50)]
+        u = Union[int, str]
+        errors = []
+
+        class A(abc.ABC):
+            pass
+
+        def worker(index):
+            try:
+                for i in range(300):
+                    issubclass(classes[(i * 7 + index) % 50], u)
+                    if index == 0 and not i % 10:
+                        A.register(type('R%d' % i, (), {}))  # New token.
+            except Exception as e:
+                errors.append(e)
+
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            with mock.patch.object(typing._subtype_cache, 'maxsize', 5):
+                threads = [threading.Thread(target=worker, args=(i,))
+                           for i in range(8)]
+                for th in threads:
+                    th.start()
+                for th in threads:
+                    th.join()
+        finally:
+            sys.setswitchinterval(interval)
+        self.assertEqual(errors, [])
+
+    def test_weak(self):
+
+        class Temp:
+            pass
+
+        ref = weakref.ref(Temp)
+        self.assertFalse(issubclass(Temp, Union[int, str]))
+        del Temp
+        gc.collect()
+        self.assertIsNone(ref())
+
+    def test_errors_not_cached(self):
+        with self.assertRaises(TypeError):
+            issubclass(42, Tuple[int])
+        self.assertEqual(subtype_cache_info().currsize, 0)
+
+
+class CompileCheckerTests(TestCase):
+
+    def types(self):
+        import collections.abc
+        E = TypeVar('E', Employee, int)
+        return [
+            int, str, Employee, Manager, object, Any, T, AnyStr, E,
+            collections.abc.Sequence, collections.abc.Hashable,
+            Union[int, str], Optional[Employee], Union[int, AnyStr],
+            Union[collections.abc.Sized, int, Employee],
+            Union[T, Manager], Union[E, str],
+            Tuple, Tuple[()], Tuple[int], Tuple[int, str],
+            Tuple[Any, int], Tuple[Any, Any], Tuple[int, Any],
+            Tuple[Union[int, str], Optional[Employee]],
+            Tuple[Tuple[int, T], AnyStr],
+            Union[int, Tuple[int, str], Tuple[str]],
+            Callable, Callable[[int], int], SimpleMapping,
+        ]
+
+    def values(self):
+
+        def f(a: int) -> int:
+            return a
+
+        return [
+            None, 42, True, 3.14, '', b'', [], {}, (), (42,), ('',),
+            (42, ''), ('', 42), (42, None), (42, Manager()), ('', Employee()),
+            ((42, ''), ''), ((42, 3.14), b''), (Employee(), 42),
+            Employee(), Manager(), ManagingFounder(), f, len,
+            MySimpleMapping(),
+        ]
+
+    def assert_same(self):
+        for t in self.types():
+            check = compile_checker(t)
+            for v in self.values():
+                self.assertEqual(check(v), isinstance(v, t), (t, v))
+
+    def test_differential(self):
+        self.assert_same()
+
+    def test_differential_bound(self):
+        with T.bind(int):
+            self.assert_same()
+        with AnyStr.bind(bytes):
+            self.assert_same()
+
+    def test_differential_validation(self):
+        with validation('shallow'):
+            self.assert_same()
+        with validation('first', 1):
+            self.assert_same()
+        check = compile_checker(Tuple[int, str])
+        self.assertFalse(check((42, 42)))
+        with validation('shallow'):
+            self.assertTrue(check((42, 42)))
+            self.assertFalse(check((42,)))
+
+    def test_binding_after_compile(self):
+        check = compile_checker(Tuple[T, str])
+        self.assertFalse(check((42, '')))
+        with T.bind(int):
+            self.assertTrue(check((42, '')))
+            self.assertFalse(check(('', '')))
+        self.assertFalse(check((42, '')))
+
+    def test_abc_register(self):
+        import abc
+
+        class Base(metaclass=abc.ABCMeta):
+            pass
+
+        class Other:
+            pass
+
+        check = compile_checker(Union[int, Base])
+        self.assertFalse(check(Other()))
+        Base.register(Other)
+        self.assertTrue(check(Other()))
+
+    def test_errors(self):
+        with self.assertRaises(TypeError):
+            compile_checker(42)
+
+
+class TypecheckedTests(TestCase):
+
+    def test_basics(self):
+
+        @typechecked
+        def f(a: int, b: str = '') -> str:
+            return b * a
+
+        self.assertEqual(f(2, 'x'), 'xx')
+        self.assertEqual(f(2), '')
+        self.assertEqual(f(b='y', a=3), 'yyy')
+        with self.assertRaises(TypeError):
+            f('x')
+        with self.assertRaises(TypeError):
+            f(2, 3)
+        with self.assertRaises(TypeError):
+            f(a=2, b=3)
+        self.assertEqual(f.__name__, 'f')
+
+    def test_return(self):
+
+        @typechecked
+        def f(a) -> int:
+            return a
+
+        self.assertEqual(f(1), 1)
+        with self.assertRaises(TypeError):
+            f('')
+
+    def test_varargs(self):
+
+        @typechecked
+        def f(a: int, *args: str, b: Employee, **kwds: float):
+            return args, kwds
+
+        self.assertEqual(f(1, 'x', 'y', b=Manager(), c=1.5)[1], {'c': 1.5})
+        with self.assertRaises(TypeError):
+            f(1, 'x', 2, b=Manager())
+        with self.assertRaises(TypeError):
+            f(1, b=42)
+        with self.assertRaises(TypeError):
+            f(1, b=Employee(), c='')
+
+    def test_positional_only(self):
+
+        @typechecked
+        def f(a: int, /, **kwds: str):
+            return a, kwds
+
+        self.assertEqual(f(1, a='x'), (1, {'a': 'x'}))
+        with self.assertRaises(TypeError):
+            f(1, a=2)
+        with self.assertRaises(TypeError):
+            f('')
+
+    def test_unannotated(self):
+
+        def f(a, b):
+            return a
+
+        self.assertIs(typechecked(f), f)
+
+        @typechecked
+        def g(a, b: int, *, c):
+            return a, b, c
+
+        self.assertEqual(g('', 1, c=''), ('', 1, ''))
+        self.assertEqual(g(a=None, b=1, c=None), (None, 1, None))
+
+    def test_defaults(self):
+
+        @typechecked
+        def f(a: Employee = None) -> Optional[Employee]:
+            return a
+
+        self.assertIsNone(f())
+        self.assertIsNone(f(None))
+        with self.assertRaises(TypeError):
+            @typechecked
+            def g(a: int = ''):
+                pass
+
+    def test_generic_types(self):
+
+        @typechecked
+        def f(a: Tuple[int, T], b: AnyStr) -> Union[int, str]:
+            return a[0]
+
+        with T.bind(str):
+            self.assertEqual(f((1, ''), b''), 1)
+            with self.assertRaises(TypeError):
+                f((1, 2), b'')
+        with self.assertRaises(TypeError):
+            f((1, 2), 3)
+
+    def test_method(self):
+
+        class C:
+            @typechecked
+            def m(self, a: int) -> int:
+                return a
+
+        self.assertEqual(C().m(1), 1)
+        with self.assertRaises(TypeError):
+            C().m('')
+
+    def test_bad_annotation(self):
+        with self.assertRaises(TypeError):
+            @typechecked
+            def f(a: 42):
+                pass
+
+
+class OverloadTests(TestCase):
+
+    def test_basics(self):
+
+        @overload
+        def f(a: int) -> str:
+            return 'int'
+
+        @overload
+        def f(a: str) -> str:
+            return 'str'
+
+        @overload
+        def f(a: int, b: int) -> str:
+            return 'two'
+
+        self.assertEqual(f(1), 'int')
+        self.assertEqual(f(''), 'str')
+        self.assertEqual(f(1, 2), 'two')
+        self.assertEqual(f(a=''), 'str')
+        self.assertEqual(f.__name__, 'f')
+        with self.assertRaises(TypeError) as cm:
+            f(3.14)
+        self.assertIn('(float)', str(cm.exception))
+
+    def test_first_match_wins(self):
+
+        @overload
+        def f(a: Employee):
+            return 'employee'
+
+        @overload
+        def f(a: Manager):
+            return 'manager'
+
+        @overload
+        def f(a):
+            return 'other'
+
+        self.assertEqual(f(Manager()), 'employee')
+        self.assertEqual(f(42), 'other')
+
+    def test_typing_annotations(self):
+
+        @overload
+        def f(a: Union[int, str], *rest: int):
+            return 'union'
+
+        @overload
+        def f(a: Tuple[int, int]):
+            return 'pair'
+
+        @overload
+        def f(a: T):
+            return 'bound'
+
+        self.assertEqual(f(1), 'union')
+        self.assertEqual(f('', 1, 2), 'union')
+        self.assertEqual(f((1, 2)), 'pair')
+        with self.assertRaises(TypeError):
+            f((1, ''))
+        with T.bind(tuple):
+            self.assertEqual(f((1, '')), 'bound')
+
+    def test_table(self):
+
+        @overload
+        def f(a: int):
+            return 'int'
+
+        @overload
+        def f(a: Iterable):
+            return 'iterable'
+
+        table = f.__overload__.table
+        self.assertEqual(f(1), 'int')
+        self.assertEqual(f([]), 'iterable')
+        self.assertEqual({types for types, _ in table.values()},
+                         {(int,), (list,)})
+        with mock.patch.object(f.__overload__, 'dispatch') as dispatch:
+            self.assertEqual(f(2), 'int')
+            self.assertEqual(f([1]), 'iterable')
+            dispatch.assert_not_called()
+
+    def test_table_equal_classes(self):
+
+        def make(*bases):
+            class Box(*bases, Generic[T]):
+                pass
+            return Box
+
+        A, B = make(Employee), make()
+        self.assertEqual(A, B)
+
+        @overload
+        def f(a: Employee):
+            return 'employee'
+
+        @overload
+        def f(a):
+            return 'other'
+
+        self.assertEqual(f(A()), 'employee')
+        self.assertEqual(f(B()), 'other')
+
+    def test_not_cached(self):
+
+        @overload
+        def f(a: Tuple[int]):
+            return 'tuple'
+
+        @overload
+        def f(a: int):
+            return 'int'
+
+        @overload
+        def f(a):
+            return 'other'
+
+        self.assertEqual(f(1), 'int')
+        self.assertEqual(f((1,)), 'tuple')
+        self.assertEqual(f(('',)), 'other')
+        self.assertEqual(f.__overload__.table, {})
+        self.assertEqual(f(a=1), 'int')
+        self.assertEqual(f.__overload__.table, {})
+
+    def test_abc_registration(self):
+
+        class A(abc.ABC):
+            pass
+
+        class B:
+            pass
+
+        @overload
+        def f(a: A):
+            return 'A'
+
+        @overload
+        def f(a):
+            return 'other'
+
+        self.assertEqual(f(B()), 'other')
+        A.register(B)
+        self.assertEqual(f(B()), 'A')
+
+    def test_redefinition(self):
+
+        def define(result):
+            @overload
+            def f(a: int):
+                return result
+            return f
+
+        f = define(1)
+        g = define(2)
+        self.assertIsNot(g, f)
+        self.assertEqual(len(f.__overload__.variants), 1)
+        self.assertEqual(len(g.__overload__.variants), 1)
+        self.assertEqual(f(0), 1)
+        self.assertEqual(g(0), 2)
+
+    def test_earlier_dispatcher_unchanged(self):
+
+        @overload
+        def f(a: int):
+            return 'int'
+
+        first = f
+
+        @overload
+        def f(a: int):
+            return 'new int'
+
+        @overload
+        def f(a: str):
+            return 'str'
+
+        self.assertEqual(first(1), 'int')
+        with self.assertRaises(TypeError):
+            first('')
+        self.assertEqual(f(1), 'new int')
+        self.assertEqual(f(''), 'str')
+        self.assertEqual(len(f.__overload__.variants), 2)
+
+    def test_method(self):
+
+        class C:
+            @overload
+            def m(self, a: int):
+                return 'int'
+
+            @overload
+            def m(self, a: str):
+                return 'str'
+
+        self.assertEqual(C().m(1), 'int')
+        self.assertEqual(C().m(''), 'str')
+
+
+class BatchTests(TestCase):
+
+    def test_rows(self):
+        row = Tuple[int, str, float]
+        rows = [(i, str(i), i / 2) for i in range(5000)]
+        self.assertTrue(check_all(row, rows))
+        self.assertIsNone(first_violation(row, rows))
+        rows[3000] = (3000, None, 1.5)
+        self.assertFalse(check_all(row, rows))
+        self.assertEqual(first_violation(row, rows), (3000, rows[3000]))
+
+    def test_classes(self):
+        self.assertTrue(check_all(int, range(3000)))
+        self.assertEqual(first_violation(int, [1, 2, '3', 4]), (2, '3'))
+        self.assertEqual(first_violation(Optional[int], iter([1, None, ''])),
+                         (2, ''))
+        self.assertEqual(first_violation(Any, [1, None]), None)
+        self.assertTrue(check_all(Employee, []))
+
+    def test_var(self):
+        self.assertFalse(check_all(T, [1]))
+        with T.bind(int):
+            self.assertTrue(check_all(T, [1]))
+
+    def test_array(self):
+        import array
+
+        class NoIter(array.array):
+            def __iter__(self):
+                raise AssertionError("Should not iterate")
+
+        a = NoIter('d', [1.0] * 10000)
+        self.assertTrue(check_all(float, a))
+        self.assertTrue(check_all(Union[int, float], a))
+        self.assertEqual(first_violation(int, a), (0, 1.0))
+        self.assertTrue(check_all(int, array.array('i')))
+        self.assertFalse(check_all(T, array.array('i', [1])))
+
+    def test_errors(self):
+        with self.assertRaises(TypeError):
+            check_all(42, [])
+
+
+class CheckedIterTests(TestCase):
+
+    def test_basics(self):
+        it = checked_iter(typing.Iterator[Tuple[int, str]],
+                          iter([(1, 'a'), (2, 'b')]))
+        self.assertEqual(list(it), [(1, 'a'), (2, 'b')])
+        it = checked_iter(typing.Iterable[int], [1, 2, ''])
+        self.assertEqual(next(it), 1)
+        self.assertEqual(next(it), 2)
+        with self.assertRaises(TypeError) as cm:
+            next(it)
+        self.assertEqual(str(cm.exception), "Item 2 must be int, got str")
+
+    def test_lazy(self):
+        consumed = []
+
+        def gen():
+            for i in range(5):
+                consumed.append(i)
+                yield i
+
+        it = checked_iter(typing.Iterator[int], gen())
+        self.assertEqual(consumed, [])
+        next(it)
+        self.assertEqual(consumed, [0])
+        self.assertEqual(list(it), [1, 2, 3, 4])
+
+    def test_every(self):
+        values = [0, '', '', 3, '', '', 6, '']
+        self.assertEqual(list(checked_iter(typing.Iterable[int], values,
+                                           every=3)),
+                         values)
+        values[6] = 'x'
+        it = checked_iter(typing.Iterable[int], values, every=3)
+        with self.assertRaises(TypeError) as cm:
+            list(it)
+        self.assertIn('Item 6 ', str(cm.exception))
+
+    def test_unchecked(self):
+        values = [1, '']
+        self.assertIs(type(checked_iter(typing.Iterable[Any], values)),
+                      type(iter(values)))
+        self.assertEqual(list(checked_iter(typing.Iterable, values)), values)
+
+    def test_compiled_once(self):
+        with mock.patch('typing.compile_checker',
+                        wraps=compile_checker) as compiled:
+            it = checked_iter(typing.Iterator[Tuple[int]], [(1,)] * 10)
+            self.assertEqual(len(list(it)), 10)
+        self.assertEqual(compiled.call_count, 1)
+
+    def test_errors(self):
+        with self.assertRaises(TypeError):
+            checked_iter(typing.List[int], [])
+        with self.assertRaises(TypeError):
+            checked_iter(int, [])
+        with self.assertRaises(ValueError):
+            checked_iter(typing.Iterable[int], [], every=0)
+
+
+class SubstituteTests(TestCase):
+
+    def test_nested(self):
+        t = substitute(Tuple[T, Callable[[T], KT]], {T: int, KT: str})
+        self.assertEqual(t, Tuple[int, Callable[[int], str]])
+        self.assertEqual(substitute(Union[T, typing.List[T]], {T: int}),
+                         Union[int, typing.List[int]])
+        self.assertIs(substitute(Optional[T], {T: int}), Optional[int])
+        self.assertIs(substitute(Union[T, int], {T: int}), int)
+
+    def test_generic_origin(self):
+        self.assertIs(substitute(typing.List[T], {T: int}),
+                      typing.List[int])
+        self.assertIs(substitute(typing.Dict[str, T], {T: int}),
+                      typing.Dict[str, int])
+        self.assertIs(typing.Dict[str, VT][str, int], typing.Dict[str, int])
+
+        class Node(Generic[T]):
+            pass
+
+        self.assertIs(substitute(Node, {T: int}), Node[int])
+        self.assertIsNone(Node.__origin__)
+        self.assertIs(Node[int].__origin__, Node)
+        with self.assertRaises(TypeError):
+            substitute(typing.List[AnyStr], {AnyStr: int})
+
+    def test_sharing(self):
+        inner = Tuple[int, Callable[[KT], str]]
+        t = Tuple[T, inner]
+        self.assertIs(substitute(t, {T: str}).__tuple_params__[1], inner)
+        self.assertIs(substitute(t, {VT: str}), t)
+        self.assertIs(substitute(int, {T: str}), int)
+        self.assertIs(substitute(t, {}), t)
+
+    def test_memoized(self):
+        t = Tuple[T, Callable[[T], KT]]
+        first = substitute(t, {T: int, KT: str})
+        with mock.patch('typing._substitute_uncached') as uncached:
+            self.assertIs(substitute(t, {KT: str, T: int}), first)
+        self.assertFalse(uncached.called)
+
+    def test_threads(self):
+        import threading
+        classes = [type('C%d' % i, (), {}) for i in range(4)]
+        t = Tuple[T, Callable[[T], T]]
+        expected = {c: Tuple[c, Callable[[c], c]] for c in classes}
+        errors = []
+
+        def worker(index):
+            try:
+                for i in range(2000):
+                    c = classes[(i * 7 + index) % 4]
+                    if substitute(t, {T: c}) is not expected[c]:
+                        errors.append(c)
+            except Exception as e:
+                errors.append(e)
+
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            with mock.patch('typing._SUBSTITUTION_CACHE_SIZE', 2):
+                threads = [threading.Thread(target=worker, args=(i,))
+                           for i in range(8)]
+                for th in threads:
+                    th.start()
+                for th in threads:
+                    th.join()
+        finally:
+            sys.setswitchinterval(interval)
+        self.assertEqual(errors, [])
+
+    def test_compact(self):
+        previous = compact_aliases()
+        try:
+            t = substitute(Tuple[T, Callable[[T], str]], {T: int})
+            self.assertEqual(t, Tuple[int, Callable[[int], str]])
+            self.assertIsInstance((1, len), t)
+        finally:
+            compact_aliases(previous)
+
+    def test_forward_ref(self):
+        t = substitute(Tuple[T], {T: 'Employee'})
+        self.assertIsInstance((Employee(),), t)
+
+    def test_errors(self):
+        with self.assertRaises(TypeError):
+            substitute(Tuple[T], {int: str})
+        with self.assertRaises(TypeError):
+            substitute(Tuple[T], {T: 42})
+
+
+class TypeUniverseTests(TestCase):
+
+    def setUp(self):
+        class Read:
+            pass
+
+        class Write:
+            pass
+
+        class Admin(Read, Write):
+            pass
+
+        class Other:
+            pass
+
+        self.Read, self.Write = Read, Write
+        self.Admin, self.Other = Admin, Other
+        self.universe = TypeUniverse([Read, Write, Admin])
+
+    def test_bits(self):
+        u = self.universe
+        self.assertEqual(u.bits(self.Read), 0b101)
+        self.assertEqual(u.bits(Union[self.Read, self.Write]), 0b111)
+        self.assertEqual(u.bits(Any), 0b111)
+        self.assertEqual(u.bits(self.Other), 0)
+        self.assertEqual(len(u), 3)
+        self.assertIn(self.Admin, u)
+        self.assertNotIn(self.Other, u)
+        with self.assertRaises(TypeError):
+            u.bits(T)
+        with self.assertRaises(TypeError):
+            u.bits(42)
+
+    def test_issubclass(self):
+        u = self.universe
+        R, W, A, O = self.Read, self.Write, self.Admin, self.Other
+        self.assertTrue(u.issubclass(Union[R, W], Union[W, A, R]))
+        self.assertTrue(u.issubclass(A, W))
+        self.assertFalse(u.issubclass(R, W))
+        self.assertFalse(u.issubclass(Union[R, W], Union[A, W]))
+        self.assertTrue(u.issubclass(R, Any))
+        # Outside the universe.
+        self.assertTrue(u.issubclass(O, Union[O, R]))
+        self.assertFalse(u.issubclass(R, O))
+        self.assertTrue(u.issubclass(Employee, Union[Employee, R]))
+        self.assertFalse(u.issubclass(int, T))
+
+    def test_union(self):
+        u = self.universe
+        R, W, A, O = self.Read, self.Write, self.Admin, self.Other
+        self.assertEqual(u.union(Union[R, A], W), Union[R, W])
+        self.assertIs(u.union(R, A), R)
+        self.assertIs(u.union(R, W), u.union(W, R))
+        self.assertEqual(u.union(R, O), Union[R, O])
+
+    def test_intersection(self):
+        u = self.universe
+        R, W, A, O = self.Read, self.Write, self.Admin, self.Other
+        self.assertIs(u.intersection(R, W), A)
+        self.assertIs(u.intersection(Union[R, W], W), W)
+        self.assertIsNone(u.intersection(R, O))
+        self.assertIs(u.intersection(Union[R, O], O), O)
+        with self.assertRaises(TypeError):
+            u.intersection()
+
+    def test_register(self):
+        u = self.universe
+        R, O = self.Read, self.Other
+        self.assertFalse(u.issubclass(Union[R, O], R))
+
+        @u.register
+        class Guest(R):
+            pass
+
+        self.assertEqual(u.bits(R), 0b1101)
+        u.register(O)
+        self.assertFalse(u.issubclass(Union[R, O], R))
+        self.assertTrue(u.issubclass(Guest, Union[R, O]))
+        with self.assertRaises(TypeError):
+            u.register(Union[R, O])
+
+    def test_abc_registration(self):
+        class Permission(abc.ABC):
+            pass
+
+        u = self.universe
+        self.assertEqual(u.bits(Permission), 0)
+        Permission.register(self.Write)
+        self.assertEqual(u.bits(Permission), 0b110)
+        self.assertTrue(u.issubclass(self.Admin, Permission))
+
+
+class AdaptiveUnionTests(TestCase):
+
+    def setUp(self):
+        self.previous = adaptive_unions()
+
+    def tearDown(self):
+        adaptive_unions(self.previous)
+
+    def test_reorder(self):
+        u = Union[int, typing.List[int], typing.Set[int],
+                  typing.Dict[int, int]]
+        params = u.__union_params__
+        r = repr(u)
+        with mock.patch('typing._UNION_REORDER_INTERVAL', 10):
+            for _ in range(7):
+                self.assertIsInstance({1: 1}, u)
+            for _ in range(3):
+                self.assertIsInstance({1}, u)
+        self.assertEqual(u.__union_other_params__,
+                         (typing.Dict[int, int], typing.Set[int],
+                          typing.List[int]))
+        self.assertIs(u.__union_params__, params)
+        self.assertEqual(repr(u), r)
+        self.assertEqual(u, Union[int, typing.List[int], typing.Set[int],
+                                  typing.Dict[int, int]])
+        self.assertNotIsInstance([None], u)
+        self.assertIsInstance([1], u)
+
+    def test_hits(self):
+        u = Union[int, str, Tuple[int]]
+        for value in [1, 2, 'a', (1,), None]:
+            isinstance(value, u)
+        self.assertEqual(union_hits(u), {int: 2, str: 1, Tuple[int]: 1})
+        self.assertEqual(list(union_hits(u)), list(u.__union_params__))
+        adaptive_unions(False)
+        isinstance(1, u)
+        self.assertEqual(union_hits(u)[int], 2)
+        with self.assertRaises(TypeError):
+            union_hits(int)
+        with self.assertRaises(TypeError):
+            union_hits(Union)
+
+
+class UnionDispatchTests(TestCase):
+
+    def setUp(self):
+        class Login:
+            pass
+
+        class Logout:
+            pass
+
+        class Data:
+            pass
+
+        self.Login, self.Logout, self.Data = Login, Logout, Data
+
+    def test_by_length(self):
+        u = Union[Tuple[self.Login, str], Tuple[self.Logout],
+                  Tuple[self.Data, bytes, int]]
+        self.assertEqual(u.__union_other_params__, ())
+        self.assertEqual(u.__union_dispatch__.candidates((1, 2)),
+                         (Tuple[self.Login, str],))
+        self.assertEqual(u.__union_dispatch__.candidates(()), ())
+        self.assertIsInstance((self.Login(), 'joe'), u)
+        self.assertIsInstance((self.Data(), b'', 42), u)
+        self.assertNotIsInstance((self.Data(), 'joe'), u)
+        self.assertNotIsInstance((), u)
+        self.assertNotIsInstance([self.Logout()], u)
+
+    def test_by_position(self):
+        Login, Logout, Data = self.Login, self.Logout, self.Data
+
+        class Relogin(Login):
+            pass
+
+        class Both(Login, Data):
+            pass
+
+        u = Union[Tuple[int, Login, str], Tuple[int, Logout, str],
+                  Tuple[int, Data, bytes]]
+        dispatch = u.__union_dispatch__
+        self.assertEqual(dispatch.candidates((1, Logout(), '')),
+                         (Tuple[int, Logout, str],))
+        self.assertEqual(dispatch.candidates((1, 2, '')), ())
+        self.assertEqual(dispatch.candidates((1, Relogin(), '')),
+                         (Tuple[int, Login, str],))
+        self.assertEqual(len(dispatch.candidates((1, Both(), b''))), 2)
+        self.assertIsInstance((1, Both(), b''), u)
+        self.assertIsInstance((1, Relogin(), ''), u)
+        self.assertNotIsInstance((1, Login(), b''), u)
+
+    def test_undiscriminated(self):
+        u = Union[Tuple[int, object], Tuple[object, int]]
+        self.assertEqual(len(u.__union_dispatch__.candidates((1, 2))), 2)
+        self.assertIsInstance(('', 1), u)
+        self.assertNotIsInstance(('', ''), u)
+
+    def test_union_match(self):
+        Login, Logout = self.Login, self.Logout
+        u = Union[int, Tuple[Login, str], Tuple[Logout], typing.List[int]]
+        self.assertIs(union_match(u, (Logout(),)), Tuple[Logout])
+        self.assertIs(union_match(u, (Login(), '')), Tuple[Login, str])
+        self.assertIs(union_match(u, True), int)
+        self.assertIs(union_match(u, [1]), typing.List[int])
+        self.assertIsNone(union_match(u, ''))
+        self.assertIs(union_match(Optional[int], None), type(None))
+        with self.assertRaises(TypeError):
+            union_match(int, 1)
+
+    def test_compact(self):
+        previous = compact_aliases()
+        try:
+            u = Union[Tuple[int], Tuple[str, str]]
+        finally:
+            compact_aliases(previous)
+        self.assertIsNotNone(u.__union_dispatch__)
+        self.assertIs(union_match(u, ('', '')), u.__union_params__[1])
+
+
+class ValidateTests(TestCase):
+
+    def module(self, source):
+        mod = types.ModuleType('validate_%s' % self._testMethodName)
+        exec(source, mod.__dict__)
+        return mod
+
+    def json_type(self):
+        return self.module(
+            "from typing import Union, List, Dict\n"
+            "JSON = Union[int, str, List['JSON'], Dict[str, 'JSON']]\n"
+        ).JSON
+
+    def test_basics(self):
+        JSON = self.json_type()
+        self.assertTrue(validate(JSON, {'a': [1, 'x', {'b': []}]}))
+        self.assertFalse(validate(JSON, {'a': [1, 'x', {'b': [None]}]}))
+        self.assertFalse(validate(JSON, {1: 1}))
+        self.assertTrue(validate(Tuple[int, str], (1, '')))
+        self.assertFalse(validate(Tuple[int, str], (1, 2)))
+        self.assertFalse(validate(Tuple[int], [1]))
+        self.assertTrue(validate(typing.List[Any], [None]))
+        self.assertTrue(validate(int, 1))
+        with self.assertRaises(TypeError):
+            validate(42, 1)
+
+    def test_cycles(self):
+        JSON = self.json_type()
+        a = [1]
+        a.append(a)
+        self.assertTrue(validate(JSON, a))
+        d = {'x': 1}
+        d['self'] = d
+        self.assertTrue(validate(JSON, d))
+        d['bad'] = None
+        self.assertFalse(validate(JSON, d))
+        a.append(None)
+        self.assertFalse(validate(JSON, a))
+
+    def test_withdrawn(self):
+        U = self.module("from typing import Union, List\n"
+                        "U = Union[int, List['U']]\n").U
+        a = []
+        b = [a]
+        a.extend([b, None])
+        # b is a List[U] only if a is a U, which it isn't, even though
+        # it was assumed to be while checking b.
+        root = Union[Tuple[U, U], Tuple[typing.Sized, U]]
+        self.assertEqual(len(root.__union_params__), 2)
+        self.assertFalse(validate(root, (a, b)))
+        self.assertTrue(validate(root, (a, [])))
+
+    def test_deep(self):
+        JSON = self.json_type()
+        value = 1
+        for _ in range(sys.getrecursionlimit() * 2):
+            value = [value]
+        self.assertTrue(validate(JSON, value))
+
+    def test_shared(self):
+        JSON = self.json_type()
+        value = [1]
+        for _ in range(100):
+            value = [value, value]
+        with mock.patch('typing._validation_goal',
+                        wraps=typing._validation_goal) as goal:
+            self.assertTrue(validate(JSON, value))
+        self.assertLess(goal.call_count, 1000)
+
+    def test_depth(self):
+        with validation('first', 1):
+            self.assertTrue(validate(typing.List[int], [1, '']))
+        self.assertFalse(validate(typing.List[int], [1, '']))
+
+
+class CheckedContainerTests(TestCase):
+
+    def test_list(self):
+        data = [1, 2]
+        lst = CheckedList(typing.List[int], data)
+        lst.append(3)
+        lst.insert(0, 0)
+        lst.extend([4, 5])
+        lst += [6]
+        lst[0] = -1
+        lst[1:3] = [10, 20]
+        self.assertIs(lst._data, data)
+        self.assertEqual(lst, [-1, 10, 20, 3, 4, 5, 6])
+        with self.assertRaises(TypeError) as cm:
+            lst.append('')
+        self.assertEqual(str(cm.exception), "Item must be int, got str")
+        with self.assertRaises(TypeError):
+            lst.extend([7, ''])
+        with self.assertRaises(TypeError):
+            lst[0] = None
+        with self.assertRaises(TypeError):
+            lst[:] = [1, None]
+        self.assertEqual(lst, [-1, 10, 20, 3, 4, 5, 6])
+        self.assertEqual(lst.pop(), 6)
+        del lst[0]
+        lst.reverse()
+        self.assertEqual(list(lst), [5, 4, 3, 20, 10])
+        self.assertEqual(repr(CheckedList(typing.List[int])),
+                         'CheckedList(typing.List[int], [])')
+
+    def test_initial(self):
+        with self.assertRaises(TypeError) as cm:
+            CheckedList(typing.List[int], [1, 2, ''])
+        self.assertEqual(str(cm.exception), "Item 2 must be int, got str")
+        with self.assertRaises(TypeError):
+            CheckedDict(typing.Dict[str, int], {'a': 'b'})
+        with self.assertRaises(TypeError):
+            CheckedSet(typing.Set[int], {''})
+
+    def test_checked_once(self):
+        with mock.patch('typing._check_item') as check:
+            lst = CheckedList(typing.List[int], list(range(100)))
+            self.assertEqual(check.call_count, 100)
+            lst.append(100)
+        self.assertEqual(check.call_count, 101)
+
+    def test_dict(self):
+        d = CheckedDict(typing.Dict[str, int], {'a': 1})
+        d['b'] = 2
+        d.update({'c': 3}, d=4)
+        d.setdefault('e', 5)
+        self.assertEqual(d, {'a': 1, 'b': 2, 'c': 3, 'd': 4, 'e': 5})
+        with self.assertRaises(TypeError):
+            d[1] = 1
+        with self.assertRaises(TypeError) as cm:
+            d['x'] = ''
+        self.assertEqual(str(cm.exception),
+                         "Value for key 'x' must be int, got str")
+        with self.assertRaises(TypeError):
+            d.update([('f', 6), ('g', '')])
+        self.assertNotIn('f', d)
+        del d['a']
+        self.assertEqual(len(d), 4)
+
+    def test_set(self):
+        s = CheckedSet(typing.Set[int])
+        s.add(1)
+        s |= {2, 3}
+        s.update([4], (5,))
+        s.discard(1)
+        self.assertEqual(s, {2, 3, 4, 5})
+        self.assertEqual(type(s | {'x'}), set)
+        with self.assertRaises(TypeError):
+            s.add('')
+        with self.assertRaises(TypeError):
+            s.update([6, ''])
+        self.assertNotIn(6, s)
+        with self.assertRaises(TypeError):
+            s |= [6, '', 7]
+        self.assertEqual(s, {2, 3, 4, 5})
+        with self.assertRaises(TypeError):
+            s ^= [2, 6, '']
+        self.assertEqual(s, {2, 3, 4, 5})
+        s ^= [2, 6]
+        self.assertEqual(s, {3, 4, 5, 6})
+        s ^= s
+        self.assertEqual(len(s), 0)
+
+    def test_nested(self):
+        lst = CheckedList(typing.MutableSequence[Tuple[int, str]])
+        lst.append((1, ''))
+        with self.assertRaises(TypeError):
+            lst.append((1, 2))
+        unchecked = CheckedList(typing.List[Any], [None])
+        unchecked.append('')
+        self.assertEqual(len(unchecked), 2)
+
+    def test_errors(self):
+        with self.assertRaises(TypeError):
+            CheckedList(typing.Dict[str, int])
+        with self.assertRaises(TypeError):
+            CheckedDict(int)
+        with self.assertRaises(TypeError):
+            CheckedSet(typing.FrozenSet[int])
+
+
+class InstrumentationTests(TestCase):
+
+    def tearDown(self):
+        disable_instrumentation()
+        reset_instrumentation()
+
+    def test_counts(self):
+        u = Union[int, Employee]
+        reset_instrumentation()
+        enable_instrumentation()
+        for _ in range(3):
+            isinstance(42, u)
+        issubclass(int, T)
+        isinstance((1,), Tuple[int])
+        disable_instrumentation()
+        isinstance(42, u)  # Not counted.
+        records = json.loads(instrumentation_report('json'))
+        counts = {(r['type'], r['check']): r['calls'] for r in records}
+        self.assertEqual(counts[repr(u), 'instance'], 3)
+        self.assertEqual(counts['~T', 'subclass'], 1)
+        self.assertEqual(counts['typing.Tuple[int]', 'instance'], 1)
+        self.assertTrue(all(r['seconds'] >= 0 for r in records))
+        table = instrumentation_report()
+        self.assertIn(repr(u), table)
+        with self.assertRaises(ValueError):
+            instrumentation_report('xml')
+
+    def test_methods_restored(self):
+        methods = [(cls, cls.__dict__.get('__instancecheck__'))
+                   for cls in (UnionMeta, GenericMeta, TypeVar)]
+        enable_instrumentation()
+        enable_instrumentation()  # No-op.
+        self.assertIsNot(UnionMeta.__dict__['__instancecheck__'],
+                         methods[0][1])
+        self.assertIn('__instancecheck__', GenericMeta.__dict__)
+        disable_instrumentation()
+        for cls, method in methods:
+            self.assertIs(cls.__dict__.get('__instancecheck__'), method)
+
+    def test_results_unchanged(self):
+        enable_instrumentation()
+        self.assertIsInstance(Manager(), Union[int, Employee])
+        self.assertNotIsInstance('', Optional[int])
+        self.assertIsInstance(MySimpleMapping(), SimpleMapping)
+        self.assertTrue(issubclass(int, Any))
+        with self.assertRaises(TypeError):
+            issubclass(42, Tuple)
+
+
 class UndefinedTest(TestCase):
 
     def test_basics(self):
@@ -667,11 +2548,128 @@ class CastTest(TestCase):
             cast('hello', 42)
 
 
+PairWithLater = Tuple['Later', int]
+
+
+class Later:
+    pass
+
+
+class StringForwardRefTests(TestCase):
+
+    def module(self, source):
+        # Forward references are cached per module, so give each test
+        # a fresh one.
+        mod = types.ModuleType('fwd_%s' % self._testMethodName)
+        exec(source, mod.__dict__)
+        return mod
+
+    def test_basics(self):
+        self.assertIsInstance((Later(), 42), PairWithLater)
+        self.assertNotIsInstance((42, 42), PairWithLater)
+        self.assertIs(PairWithLater.__tuple_params__[0], forwardref('Later'))
+        self.assertIs(Tuple['Later', int], PairWithLater)
+        self.assertEqual(repr(forwardref('Later')), "forwardref('Later')")
+
+    def test_lazy(self):
+        mod = self.module("from typing import Union, Optional\n"
+                          "u = Union[int, 'Name']\n"
+                          "o = Optional['Name']\n")
+        self.assertIsInstance(42, mod.u)  # Doesn't need the reference.
+        with self.assertRaises(NameError):
+            isinstance('', mod.u)
+        mod.Name = str
+        self.assertIsInstance('', mod.u)
+        self.assertIsInstance('', mod.o)
+        self.assertIsInstance(None, mod.o)
+        self.assertNotIsInstance(3.14, mod.u)
+        self.assertTrue(issubclass(str, mod.u))
+
+    def test_cached(self):
+        ref = forwardref('Later')
+        self.assertIsInstance(Later(), ref)
+        with mock.patch('builtins.eval') as ev:
+            self.assertIsInstance(Later(), ref)
+            self.assertFalse(issubclass(int, ref))
+            ev.assert_not_called()
+
+    def test_subclass_side(self):
+        self.assertTrue(issubclass(forwardref('Later'), Union[int, Later]))
+        self.assertTrue(issubclass(Tuple['Later'], Tuple[Later]))
+        self.assertTrue(issubclass(forwardref('Manager'),
+                                   forwardref('Employee')))
+
+    def test_no_pruning(self):
+        u = Union['Name', Employee, Manager, object]
+        self.assertEqual(u.__union_params__, (forwardref('Name'), object))
+
+    def test_no_pruning_nested(self):
+        mod = self.module("from typing import Union, Tuple\n"
+                          "u = Union[Tuple['Name'], Tuple[int]]\n"
+                          "v = Union[Tuple['Name', int], Tuple[str, int]]\n")
+        self.assertEqual(len(mod.u.__union_params__), 2)
+        self.assertEqual(len(mod.v.__union_params__), 2)
+        mod.Name = int
+        self.assertIsInstance((42,), mod.u)
+        self.assertIsInstance(('', 42), mod.v)
+        self.assertNotIsInstance((3.14,), mod.u)
+
+    def test_generic(self):
+        t = SimpleMapping['Later', 'Name']
+        self.assertEqual(t.__parameters__,
+                         (forwardref('Later'), forwardref('Name')))
+
+    def test_callable(self):
+        c = Callable[['Later'], int]
+
+        def f(a: 'Later') -> 'int':
+            return 0
+
+        def g(a: 'Employee') -> int:
+            return 0
+
+        self.assertIsInstance(f, c)
+        self.assertNotIsInstance(g, c)
+
+    def test_typechecked(self):
+        mod = self.module("from typing import typechecked, Optional\n"
+                          "@typechecked\n"
+                          "def f(a: 'Name') -> 'Optional[Name]':\n"
+                          "    return a\n")
+        mod.Name = Later
+        later = Later()
+        self.assertIs(mod.f(later), later)
+        with self.assertRaises(TypeError):
+            mod.f(42)
+
+    def test_resolve_module(self):
+        mod = self.module("from typing import Union\n"
+                          "u = Union[int, 'Name', 'Other']\n")
+        with self.assertRaises(NameError):
+            resolve_forward_refs(mod)
+        mod.Name = str
+        mod.Other = bytes
+        resolve_forward_refs(mod.__name__)
+        with mock.patch('builtins.eval') as ev:
+            self.assertIsInstance(b'', mod.u)
+            ev.assert_not_called()
+
+    def test_errors(self):
+        with self.assertRaises(TypeError):
+            Union[int, 'not an expression']
+        with self.assertRaises(TypeError):
+            forwardref(42)
+        mod = self.module("from typing import forwardref\n"
+                          "ref = forwardref('42')\n")
+        with self.assertRaises(TypeError):
+            isinstance(42, mod.ref)
+
+
 class ForwardRefTest(TestCase):
 
     def test_basics(self):
 
-        class Node(Generic[T]):
+        class Node(Generic[T], forward=True):
             pass  # Foward reference
 
         save_Node = Node
@@ -690,3 +2688,56 @@ class ForwardRefTest(TestCase):
         t = Node[int]
         ann = t.add_left.__annotations__
         assert ann['node'] == Optional[Node[T]]
+
+    def test_subscribed_before_definition(self):
+
+        class Node(Generic[T], forward=True):
+            pass
+
+        int_node = Node[int]
+
+        class Node(Generic[T]):
+            x = 1
+
+            def m(self):
+                return self.x
+
+        self.assertIs(Node[int], int_node)
+        self.assertEqual(int_node.x, 1)
+        self.assertTrue(hasattr(int_node, 'm'))
+        self.assertEqual(Node[str].x, 1)
+
+    def test_redefinition_without_declaration(self):
+
+        class Node(Generic[T]):
+            pass
+
+        save_Node = Node
+
+        class Node(Generic[T]):
+            pass
+
+        self.assertIsNot(Node, save_Node)
+
+    def test_subscription_does_not_complete(self):
+
+        class Node(Generic[T], forward=True):
+            pass
+
+        save_Node = Node
+        Node[int]  # Same module and qualname, but not a definition.
+
+        class Node(Generic[T]):
+            x = 1
+
+        self.assertIs(Node, save_Node)
+        self.assertEqual(Node.x, 1)
+
+    def test_mismatch(self):
+
+        class Node(Generic[T], forward=True):
+            pass
+
+        with self.assertRaises(TypeError):
+            class Node(Generic[KT]):
+                pass
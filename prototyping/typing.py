@@ -6,21 +6,21 @@
 # [done] Tuple
 # [done] Callable
 # [done] Generic
-# Protocol (similar to Generic, but for structural matching)
-# All the collections ABCs (with Set renamed to AbstractSet):
+# [done] Protocol (similar to Generic, but for structural matching)
+# [done] All the collections ABCs (with Set renamed to AbstractSet):
 #   Hashable, Iterable, Iterator,
 #   Sized, Container, *Abstract*Set, MutableSet, Mapping, MutableMapping,
 #   MappingView, KeysView, ItemsView, ValuesView,
 #   Sequence, MutableSequence
 #   ByteString
-# List, Dict, Set; FrozenSet?
+# [done] List, Dict, Set; FrozenSet?
 # Other things from mypy's typing.py:
 # - [done] Undefined
-# - IO, BinaryIO, TextIO (?)
-# - Match, Pattern (?)
+# - [done] IO, BinaryIO, TextIO (?)
+# - [done] Match, Pattern (?)
 # - [done] cast
-# - forwardref
-# - overload
+# - [done] forwardref
+# - [done] overload
 # - [done] typevar (alias for TypeVar)
 # Even more things from mypy's typing.py (that aren't in its __all__)
 
@@ -30,10 +30,101 @@
 # Make it pep8-clean.
 
 import abc
+import array
+import collections
 import collections.abc
+import contextlib
+import contextvars
+import functools
 import inspect
+import io
+import itertools
+import os
+import random
+import re
 import sys
+import threading
+import time
 import types
+import weakref
+
+__all__ = [
+    # Special forms and type variables.
+    'Any',
+    'TypeVar',
+    'typevar',
+    'VarBinding',
+    'T',
+    'KT',
+    'VT',
+    'AnyStr',
+    'Union',
+    'Optional',
+    'Tuple',
+    'Callable',
+    'Generic',
+    'Protocol',
+    # Generic versions of collections.abc classes.
+    'Hashable',
+    'Iterable',
+    'Iterator',
+    'Sized',
+    'Container',
+    'AbstractSet',
+    'MutableSet',
+    'Mapping',
+    'MutableMapping',
+    'MappingView',
+    'KeysView',
+    'ItemsView',
+    'ValuesView',
+    'Sequence',
+    'MutableSequence',
+    'ByteString',
+    # Generic versions of concrete collections.
+    'List',
+    'Dict',
+    'Set',
+    'FrozenSet',
+    # Other library types.
+    'IO',
+    'BinaryIO',
+    'TextIO',
+    'Match',
+    'Pattern',
+    # Functions and other helpers.
+    'Undefined',
+    'cast',
+    'substitute',
+    'TypeUniverse',
+    'overload',
+    'forwardref',
+    'resolve_forward_refs',
+    'TypeCacheInfo',
+    'type_cache_info',
+    'type_cache_clear',
+    'subtype_cache_info',
+    'subtype_cache_clear',
+    'compile_checker',
+    'typechecked',
+    'check_all',
+    'first_violation',
+    'checked_iter',
+    'CheckedList',
+    'CheckedDict',
+    'CheckedSet',
+    'validate',
+    'compact_aliases',
+    'adaptive_unions',
+    'union_hits',
+    'union_match',
+    'set_validation',
+    'validation',
+    'enable_instrumentation',
+    'disable_instrumentation',
+    'reset_instrumentation',
+    'instrumentation_report',
+]
 
 
 class TypingMeta(type):
@@ -69,6 +160,63 @@ class Final:
         raise TypeError("Cannot instantiate %r" % self.__class__)
 
 
+_compact_aliases = False
+
+
+def compact_aliases(enabled=True):
+    """Turn compact parameterizations of Tuple and Callable on or off.
+
+    When on, Tuple[...] and Callable[...] return small alias objects
+    instead of new classes; see _TypeAlias.  Parameterizations made
+    before the switch keep their form.  Return the previous setting.
+    """
+    global _compact_aliases
+    previous = _compact_aliases
+    _compact_aliases = bool(enabled)
+    return previous
+
+
+class _TypeAlias:
+    """Compact form of a parameterized Tuple or Callable.
+
+    A class such as Tuple[int, str] carries a copy of the namespace of
+    Tuple and all the other bookkeeping of a class, which adds up to
+    well over a kilobyte.  An alias only holds the unparameterized
+    class as __origin__ plus the parameters, under the attribute names
+    the class form uses, so the metaclass methods of __origin__ work
+    on it unchanged; instance and subclass checks and repr() are
+    forwarded to them.
+
+    An alias is not a class.  It can be used as the second argument of
+    isinstance() and issubclass() and as a parameter of other types,
+    but as the first argument of issubclass() only the typing classes
+    accept it, not ABCs.
+    """
+
+    __slots__ = ('__origin__', '__weakref__')
+
+    def __instancecheck__(self, instance):
+        return type(self.__origin__).__instancecheck__(self, instance)
+
+    def __subclasscheck__(self, cls):
+        return type(self.__origin__).__subclasscheck__(self, cls)
+
+    def __repr__(self):
+        return (repr(self.__origin__) +
+                type(self.__origin__)._params_repr(self))
+
+    # The same bases as the class form, so that ordinary classes see
+    # e.g. issubclass(Tuple[int], object) the same way.
+
+    @property
+    def __bases__(self):
+        return self.__origin__.__bases__
+
+    @property
+    def __mro__(self):
+        return (self,) + self.__origin__.__mro__[1:]
+
+
 def _type_check(arg, msg):
     """Check that the argument is a type, and return it.
 
@@ -81,7 +229,7 @@ def _type_check(arg, msg):
     """
     if arg is None:
         return type(None)
-    if not isinstance(arg, type):
+    if not isinstance(arg, (type, _TypeAlias)):
         raise TypeError(msg + " Got %.100r." % (arg,))
     return arg
 
@@ -103,6 +251,319 @@ def _type_repr(obj):
         return repr(obj)
 
 
+def _type_param(arg):
+    """Turn a string parameter of a type expression into a forward reference.
+
+    The reference is resolved (later) in the globals of the module
+    that wrote the type expression.  Anything else is returned as is.
+    """
+    if isinstance(arg, str):
+        f = sys._getframe(1)
+        while f.f_globals is globals():
+            f = f.f_back
+        return _forward_ref(arg, f.f_globals)
+    return arg
+
+
+TypeCacheInfo = collections.namedtuple('TypeCacheInfo',
+                                       'hits misses currsize')
+
+
+class _TypeCache:
+    """Intern table for subscripted types.
+
+    Subscribing a typing class (e.g. Union[int, str]) creates a new
+    class.  This table maps the origin and the parameters of a
+    subscription to the class it produced, so that an identical
+    subscription returns the same object.
+
+    Entries are keyed on the identity of the origin and parameters
+    (typing classes define a looser __eq__ than identity) and only
+    hold weak references; an entry disappears as soon as its result
+    is garbage collected and is ignored once any of its arguments is.
+    Only the reference to the result has a callback, so that the
+    references to the arguments are the shared ones weakref.ref()
+    returns without a callback.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._remove = self._remove_entry
+        self.hits = 0
+        self.misses = 0
+
+    def _remove_entry(self, ref):
+        entry = self._entries.get(ref.key)
+        if entry is not None and entry[0] is ref:
+            del self._entries[ref.key]
+
+    def lookup(self, origin, parameters, factory):
+        """Return the interned result of factory().
+
+        The key is (origin, *parameters); None parameters are treated
+        as type(None).  If some argument cannot be weakly referenced
+        the factory is called without interning the result.
+        """
+        args = (origin,) + tuple(type(None) if p is None else p
+                                 for p in parameters)
+        key = tuple(map(id, args))
+        entry = self._entries.get(key)
+        if entry is not None:
+            ref, arg_refs = entry
+            result = ref()
+            if (result is not None and
+                all(r() is a for r, a in zip(arg_refs, args))):
+                self.hits += 1
+                return result
+        self.misses += 1
+        result = factory()
+        try:
+            self._entries[key] = (weakref.KeyedRef(result, self._remove, key),
+                                  tuple(map(weakref.ref, args)))
+        except TypeError:
+            pass  # Not weakly referenceable; don't intern.
+        return result
+
+    def results(self, origin):
+        """Return the live results whose origin is origin."""
+        results = []
+        for ref, arg_refs in list(self._entries.values()):
+            result = ref()
+            if result is not None and arg_refs[0]() is origin:
+                results.append(result)
+        return results
+
+    def info(self):
+        return TypeCacheInfo(self.hits, self.misses, len(self._entries))
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = self.misses = 0
+
+
+_type_cache = _TypeCache()
+
+
+class _IdentityCache:
+    """Mapping from weakly referenced objects to values, by identity.
+
+    Unlike weakref.WeakKeyDictionary, keys are matched on identity
+    rather than ==, so two classes that compare equal (e.g. distinct
+    generic classes of the same name and parameters) never share an
+    entry.  An entry disappears when its key is garbage collected.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._remove = self._remove_entry
+
+    def _remove_entry(self, ref):
+        entry = self._entries.get(ref.key)
+        if entry is not None and entry[0] is ref:
+            del self._entries[ref.key]
+
+    def get(self, key, default=None):
+        entry = self._entries.get(id(key))
+        if entry is not None and entry[0]() is key:
+            return entry[1]
+        return default
+
+    def __getitem__(self, key):
+        entry = self._entries.get(id(key))
+        if entry is None or entry[0]() is not key:
+            raise KeyError(key)
+        return entry[1]
+
+    def __setitem__(self, key, value):
+        self._entries[id(key)] = (
+            weakref.KeyedRef(key, self._remove, id(key)), value)
+
+    def __contains__(self, key):
+        entry = self._entries.get(id(key))
+        return entry is not None and entry[0]() is key
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+
+
+def type_cache_info():
+    """Report statistics of the subscription intern table.
+
+    Returns a named tuple (hits, misses, currsize).
+    """
+    return _type_cache.info()
+
+
+def type_cache_clear():
+    """Clear the subscription intern table and its statistics."""
+    _type_cache.clear()
+
+
+# Maximum number of entries in the subtype cache.
+_SUBTYPE_CACHE_SIZE = 4096
+
+
+class _SubtypeCache:
+    """Memo of subclass checks against typing constructs.
+
+    The subclass checks of Union and Tuple recurse into their
+    parameters, which adds up for nested types.  (Callable is
+    invariant, and comparing its parameters is cheaper than a lookup
+    here.)  This table
+    keeps the results keyed on the identity of (subclass, superclass)
+    and evicts the least recently used entry beyond maxsize.
+
+    Entries hold weak references to the pair, so they don't keep
+    classes alive, and are all dropped when an ABC is registered,
+    since that may change any answer.  An entry also records the
+    type variables the pair mentions; while any of them is bound the
+    entry is bypassed, and nothing is stored.
+
+    The table is shared between threads, so a lock guards each
+    lookup and each update (but not the check itself, which may
+    recurse into the table).
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._token = abc.get_cache_token()
+        self.hits = 0
+        self.misses = 0
+
+    def check(self, method, sup, sub):
+        """Return method(sup, sub), i.e. issubclass(sub, sup)."""
+        token = abc.get_cache_token()
+        key = (id(sub), id(sup))
+        with self._lock:
+            if token != self._token:
+                self._entries.clear()
+                self._token = token
+            entry = self._entries.get(key)
+            if entry is not None:
+                sub_ref, sup_ref, result, type_vars = entry
+                if (sub_ref() is sub and sup_ref() is sup and
+                        all(v.__binding__ is None for v in type_vars)):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return result
+        if entry is not None and sub_ref() is sub and sup_ref() is sup:
+            return method(sup, sub)  # A variable is bound.
+        self.misses += 1
+        result = method(sup, sub)
+        type_vars = _type_vars(sub) | _type_vars(sup)
+        if any(v.__binding__ is not None for v in type_vars):
+            return result
+        try:
+            entry = (weakref.ref(sub), weakref.ref(sup),
+                     result, tuple(type_vars))
+        except TypeError:
+            return result  # Not weakly referenceable; don't cache.
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return result
+
+    def info(self):
+        return TypeCacheInfo(self.hits, self.misses, len(self._entries))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+
+_subtype_cache = _SubtypeCache(_SUBTYPE_CACHE_SIZE)
+
+
+def subtype_cache_info():
+    """Return (hits, misses, currsize) of the subtype cache."""
+    return _subtype_cache.info()
+
+
+def subtype_cache_clear():
+    """Empty the subtype cache and reset its statistics."""
+    _subtype_cache.clear()
+
+
+def _cached_subclasscheck(method):
+    """Make a metaclass __subclasscheck__ go through the subtype cache."""
+
+    @functools.wraps(method)
+    def __subclasscheck__(self, cls):
+        return _subtype_cache.check(method, self, cls)
+
+    return __subclasscheck__
+
+
+def _type_vars(t):
+    """Return the set of type variables in the type expression t."""
+    if isinstance(t, TypeVar):
+        found = {t}
+        params = t.__constraints__
+    elif isinstance(t, _ForwardRef):
+        return _type_vars(t.__forward_value__)
+    else:
+        found = set()
+        if isinstance(t, UnionMeta):
+            params = t.__union_params__
+        elif isinstance(t, (TupleMeta, _TupleAlias)):
+            params = t.__tuple_params__
+        elif isinstance(t, (CallableMeta, _CallableAlias)):
+            params = t.__args__ and t.__args__ + (t.__result__,)
+        elif isinstance(t, GenericMeta):
+            params = t.__parameters__
+        else:
+            params = None
+    for p in params or ():
+        found |= _type_vars(p)
+    return found
+
+
+def _forward_unresolved(t):
+    """Return whether the type expression t has an unresolved forward ref."""
+    if isinstance(t, _ForwardRef):
+        return (t.__forward_value__ is None or
+                _forward_unresolved(t.__forward_value__))
+    if isinstance(t, TypeVar):
+        params = t.__constraints__
+    elif isinstance(t, UnionMeta):
+        params = t.__union_params__
+    elif isinstance(t, (TupleMeta, _TupleAlias)):
+        params = t.__tuple_params__
+    elif isinstance(t, (CallableMeta, _CallableAlias)):
+        params = t.__args__ and t.__args__ + (t.__result__,)
+    elif isinstance(t, GenericMeta):
+        params = t.__parameters__
+    else:
+        params = None
+    return any(_forward_unresolved(p) for p in params or ())
+
+
+def _type_determined(t):
+    """Return whether isinstance(x, t) only depends on x's class.
+
+    That is the case for ordinary classes and ABCs (whose registry
+    changes are tracked by abc.get_cache_token()), and for type
+    variables without a binding whose constraints qualify.  Callers
+    must still check that the variables are unbound at check time.
+    """
+    if isinstance(t, TypeVar):
+        return all(_type_determined(c) and not isinstance(c, TypeVar)
+                   for c in t.__constraints__)
+    if isinstance(t, GenericMeta):
+        return t.__element_params__ is None
+    return type(t).__instancecheck__ in (type.__instancecheck__,
+                                         abc.ABCMeta.__instancecheck__,
+                                         ProtocolMeta.__instancecheck__)
+
+
 class AnyMeta(TypingMeta):
     """Metaclass for Any."""
 
@@ -114,7 +575,7 @@ class AnyMeta(TypingMeta):
         return True
 
     def __subclasscheck__(self, cls):
-        if not isinstance(cls, type):
+        if not isinstance(cls, (type, _TypeAlias)):
             return super().__subclasscheck__(cls)  # To TypeError.
         return True
 
@@ -171,6 +632,8 @@ class TypeVar(TypingMeta, metaclass=TypingMeta, _root=True):
     There is still a difference between T and int; issubclass(T, int)
     is False.  However, issubclass(int, T) is true.
 
+    Bindings are local to the current thread or asyncio Task.
+
     Binding a constrained type variable will replace the binding type
     with the most derived of its constraints that matches.  Example::
 
@@ -190,15 +653,24 @@ class TypeVar(TypingMeta, metaclass=TypingMeta, _root=True):
         self = super().__new__(cls, name, (Final,), {}, _root=True)
         msg = "TypeVar(name, constraint, ...): constraints must be types."
         self.__constraints__ = tuple(_type_check(t, msg) for t in constraints)
-        self.__binding__ = None
+        # The binding lives in a context variable, so that each thread
+        # and each asyncio Task sees its own.  The value is None or a
+        # (binding, VarBinding, outer value) triple.
+        self.__binding_var__ = contextvars.ContextVar(name, default=None)
         return self
 
+    @property
+    def __binding__(self):
+        bound = self.__binding_var__.get()
+        return None if bound is None else bound[0]
+
     def __repr__(self):
         return '~' + self.__name__
 
     def __instancecheck__(self, instance):
-        if self.__binding__ is not None:
-            return isinstance(instance, self.__binding__)
+        bound = self.__binding_var__.get()
+        if bound is not None:
+            return isinstance(instance, bound[0])
         elif not self.__constraints__:
             return False
         else:
@@ -207,8 +679,10 @@ class TypeVar(TypingMeta, metaclass=TypingMeta, _root=True):
     def __subclasscheck__(self, cls):
         if cls is self:
             return True
-        elif self.__binding__ is not None:
-            return issubclass(cls, self.__binding__)
+        cls = _resolved(cls)
+        bound = self.__binding_var__.get()
+        if bound is not None:
+            return issubclass(cls, bound[0])
         elif not self.__constraints__:
             return False
         else:
@@ -228,15 +702,23 @@ class TypeVar(TypingMeta, metaclass=TypingMeta, _root=True):
             binding = best
         return VarBinding(self, binding)
 
-    def _bind(self, binding):
-        old_binding = self.__binding__
-        self.__binding__ = binding
-        return old_binding
+    def _is_bound_by(self, var_binding):
+        bound = self.__binding_var__.get()
+        while bound is not None:
+            if bound[1] is var_binding:
+                return True
+            bound = bound[2]
+        return False
+
+    def _bind(self, binding, var_binding):
+        outer = self.__binding_var__.get()
+        self.__binding_var__.set((binding, var_binding, outer))
 
-    def _unbind(self, binding, old_binding):
-        assert self.__binding__ is binding, (self.__binding__,
-                                             binding, old_binding)
-        self.__binding__ = old_binding
+    def _unbind(self, var_binding):
+        bound = self.__binding_var__.get()
+        assert bound is not None and bound[1] is var_binding, (
+            bound, var_binding)
+        self.__binding_var__.set(bound[2])
 
 
 # Compatibility for for mypy's typevar().
@@ -245,23 +727,22 @@ def typevar(name, values=()):
 
 
 class VarBinding:
-    """TypeVariable binding returned by TypeVar.bind()."""
+    """TypeVariable binding returned by TypeVar.bind().
 
-    # TODO: This is not thread-safe.  We could solve this in one of
-    # two ways: by using a lock or by using thread-local state.  But
-    # either of these feels overly heavy, and still doesn't work
-    # e.g. in an asyncio Task.
+    Bindings are stored in a context variable, so a binding made in
+    one thread or asyncio Task is not visible in another (although
+    a Task does inherit the bindings in effect when it was created).
+    A VarBinding itself holds no state and may be shared freely.
+    """
 
     def __init__(self, var, binding):
         assert isinstance(var, TypeVar), (var, binding)
         assert isinstance(binding, type), (var, binding)
         self._var = var
         self._binding = binding
-        self._old_binding = None
-        self._entered = False
 
     def __enter__(self):
-        if self._entered:
+        if self._var._is_bound_by(self):
             # This checks for the following scenario:
             # bv = T.bind(<some_type>)
             # with bv:
@@ -278,15 +759,10 @@ class VarBinding:
             #     with T.bind(<some_other_type>):
             #         ...
             raise TypeError("Cannot reuse variable binding recursively.")
-        self._old_binding = self._var._bind(self._binding)
-        self._entered = True
+        self._var._bind(self._binding, self)
 
     def __exit__(self, *args):
-        try:
-            self._var._unbind(self._binding, self._old_binding)
-        finally:
-            self._entered = False
-            self._old_binding = None
+        self._var._unbind(self)
 
 
 # Some unconstrained type variables.  These are used by the container types.
@@ -299,8 +775,266 @@ VT = TypeVar('VT')  # Value type.
 AnyStr = TypeVar('AnyStr', bytes, str)
 
 
+class _ForwardRef(TypingMeta, metaclass=TypingMeta, _root=True):
+    """Forward reference to a type, written as a string.
+
+    Strings among the parameters of Union, Optional, Tuple, Callable
+    or a generic class become forward references, as do string
+    annotations when Callable[...] or @typechecked look at them.  A
+    forward reference is evaluated in the globals of the module where
+    it was written, but only when it is first used in an instance or
+    subclass check; the result is kept.  Use forwardref() to create
+    one explicitly and resolve_forward_refs() to resolve all those of
+    a module up front.
+
+    There is a single forward reference object per module and string.
+    """
+
+    def __new__(cls, arg, globalns):
+        try:
+            code = compile(arg, '<forward reference>', 'eval')
+        except SyntaxError:
+            raise TypeError("Forward reference must be an expression. "
+                            "Got %.100r." % (arg,))
+        self = super().__new__(cls, arg, (Final,), {}, _root=True)
+        self.__forward_arg__ = arg
+        self.__forward_code__ = code
+        self.__forward_globals__ = globalns
+        self.__forward_value__ = None
+        return self
+
+    def __repr__(self):
+        return 'forwardref(%r)' % (self.__forward_arg__,)
+
+    def _resolve(self):
+        value = self.__forward_value__
+        if value is None:
+            value = eval(self.__forward_code__, self.__forward_globals__)
+            msg = "Forward references must evaluate to types."
+            value = _type_check(value, msg)
+            self.__forward_value__ = value
+        return value
+
+    def __instancecheck__(self, instance):
+        return isinstance(instance, self._resolve())
+
+    def __subclasscheck__(self, cls):
+        if cls is self:
+            return True
+        return issubclass(_resolved(cls), self._resolve())
+
+
+def _resolved(t):
+    """Resolve t if it is a forward reference.
+
+    Ordinary classes can't see through forward references, so
+    issubclass(forwardref('int'), int) is False.  The subclass checks
+    of the typing classes resolve their argument with this first.
+    """
+    if isinstance(t, _ForwardRef):
+        return t._resolve()
+    return t
+
+
+# Forward references by module name and string.
+_forward_refs = {}
+
+
+def _forward_ref(arg, globalns):
+    refs = _forward_refs.setdefault(globalns.get('__name__'), {})
+    ref = refs.get(arg)
+    if ref is None or ref.__forward_globals__ is not globalns:
+        ref = refs[arg] = _ForwardRef(arg, globalns)
+    return ref
+
+
+def forwardref(name):
+    """Return a forward reference to the type named by a string.
+
+    The string is evaluated lazily in the caller's module; see
+    _ForwardRef for details.
+    """
+    if not isinstance(name, str):
+        raise TypeError("forwardref(name): name must be a string.")
+    return _forward_ref(name, sys._getframe(1).f_globals)
+
+
+def resolve_forward_refs(module):
+    """Resolve all forward references written in a module.
+
+    The module may be given as a module object or by name.  Call
+    this e.g. at startup, so that the first checks don't pay for
+    evaluating the references.  If some cannot be resolved a
+    NameError listing them is raised (after trying all of them).
+    """
+    name = getattr(module, '__name__', module)
+    failed = []
+    for arg, ref in list(_forward_refs.get(name, {}).items()):
+        try:
+            ref._resolve()
+        except Exception:
+            failed.append(arg)
+    if failed:
+        raise NameError("Cannot resolve forward references in %s: %s" %
+                        (name, ', '.join(map(repr, failed))))
+
+
+def _remove_subclasses(params):
+    """Drop each type that is a subclass of another one in params.
+
+    The types are visited in order and a type is dropped if it is a
+    subclass of any type that hasn't been dropped yet, so of two
+    types that are subclasses of each other the first one goes.
+
+    Types whose metaclass doesn't override __subclasscheck__ are
+    only ever superclasses through the MRO, so for those we look up
+    each candidate's ancestors in a set instead of calling issubclass()
+    for every pair.  Only types with custom subclass checks (ABCs,
+    typing classes) need to be tried one by one.
+
+    Forward references are left alone, since looking at them would
+    resolve them prematurely; so are types with unresolved forward
+    references among their parameters, e.g. Tuple['Later'].  ABCs
+    only take classes as subclasses, so compact aliases are never
+    dropped in favor of an ABC.
+    """
+    plain = set()
+    special = {}  # Used as an ordered set.
+    forward = set()
+    for t in params:
+        if isinstance(t, _ForwardRef) or _forward_unresolved(t):
+            forward.add(t)
+        elif type(t).__subclasscheck__ is type.__subclasscheck__:
+            plain.add(t)
+        else:
+            special[t] = None
+    for t1 in params:
+        if t1 in forward:
+            continue
+        if (any(base in plain for base in t1.__mro__[1:]) or
+            any(issubclass(t1, t2) for t2 in special
+                if t2 is not t1 and not (isinstance(t1, _TypeAlias) and
+                                         isinstance(t2, abc.ABCMeta)))):
+            if t1 in special:
+                del special[t1]
+            else:
+                plain.remove(t1)
+    return [t for t in params if t in plain or t in special or t in forward]
+
+
+# Whether Union instance checks count hits per member and reorder the
+# members they have to try one by one; see adaptive_unions().
+_adaptive_unions = False
+_UNION_REORDER_INTERVAL = 1024
+
+
+def adaptive_unions(enabled=True):
+    """Turn adaptive ordering of Union instance checks on or off.
+
+    isinstance(x, Union[...]) looks up most members in a per-class
+    cache, but members whose check depends on more than the class
+    (e.g. List[int]) are tried in order for every instance.  In
+    adaptive mode each union counts which member matched, and every
+    1024 checks it tries those members most frequently matched
+    first.  __union_params__, equality and repr don't change.  See
+    union_hits() for the counts.
+
+    Returns the previous setting.
+    """
+    global _adaptive_unions
+    previous = _adaptive_unions
+    _adaptive_unions = bool(enabled)
+    return previous
+
+
+def union_hits(u):
+    """Return how often each member of a Union matched an instance.
+
+    The result maps the members to their counts, in the order of
+    __union_params__.  Only checks done in adaptive mode are counted.
+    """
+    if not isinstance(u, UnionMeta) or u.__union_params__ is None:
+        raise TypeError("union_hits(u): u must be a subscripted Union. "
+                        "Got %.100r." % (u,))
+    return {t: u.__union_hits__.get(t, 0) for t in u.__union_params__}
+
+
+def union_match(u, instance):
+    """Return the member of a Union that matches instance, or None.
+
+    This does the same work as isinstance(instance, u), so callers
+    that go on to handle each member differently don't have to test
+    the members again.  If several members match, any of them may be
+    returned.
+    """
+    if not isinstance(u, UnionMeta) or u.__union_params__ is None:
+        raise TypeError("union_match(u, instance): u must be a subscripted "
+                        "Union. Got %.100r." % (u,))
+    match = u._match(instance)
+    return None if match is False else match
+
+
+class _TupleDispatch:
+    """Index of the Tuple members of a union.
+
+    Given a tuple, candidates() returns the members it can match
+    without looking at each one.  Members are grouped by length; if
+    a group has several members, they are told apart by the class of
+    the element at a fixed position, if there is one where their
+    parameters are plain classes none of which is a subclass of
+    another.  Otherwise the whole group is returned.
+    """
+
+    __slots__ = ('_by_length',)
+
+    def __init__(self, members):
+        groups = {}
+        for t in members:
+            groups.setdefault(len(t.__tuple_params__), []).append(t)
+        # {length: (position, {class: member}) or (None, members)}
+        self._by_length = {}
+        for length, group in groups.items():
+            self._by_length[length] = self._discriminate(group, length)
+
+    @staticmethod
+    def _discriminate(group, length):
+        if len(group) > 1:
+            for i in range(length):
+                params = [t.__tuple_params__[i] for t in group]
+                if (all(isinstance(p, type) and
+                        type(p).__subclasscheck__ is type.__subclasscheck__
+                        for p in params) and
+                    not any(p is not q and issubclass(p, q)
+                            for p in params for q in params) and
+                        len(set(params)) == len(params)):
+                    return i, dict(zip(params, group))
+        return None, tuple(group)
+
+    def candidates(self, instance):
+        entry = self._by_length.get(len(instance))
+        if entry is None:
+            return ()
+        position, index = entry
+        if position is None:
+            return index
+        element = instance[position]
+        cls = type(element)
+        if element.__class__ is not cls:
+            return tuple(index.values())
+        match = index.get(cls)
+        if match is not None:
+            return (match,)
+        # Several, with multiple inheritance.
+        return tuple(index[c] for c in cls.__mro__ if c in index)
+
+
 class UnionMeta(TypingMeta):
-    """Metaclass for Union."""
+    """Metaclass for Union.
+
+    Members whose instance check depends on more than the class are
+    tried one by one, except Tuple members, which are looked up in a
+    _TupleDispatch when there are several of them.
+    """
 
     def __new__(cls, name, bases, namespace, parameters=None, _root=False):
         if parameters is None:
@@ -329,19 +1063,37 @@ class UnionMeta(TypingMeta):
         # E.g. Union[int, Employee, Manager] == Union[int, Employee].
         # If Any or object is present it will be the sole survivor.
         # If both Any and object are present, Any wins.
-        all_params = set(params)
-        for t1 in params:
-            if t1 is Any:
-                return Any
-            if any(issubclass(t1, t2) for t2 in all_params - {t1}):
-                all_params.remove(t1)
+        if any(t is Any for t in params):
+            return Any
+        params = _remove_subclasses(params)
         # It's not a union if there's only one type left.
-        if len(all_params) == 1:
-            return all_params.pop()
+        if len(params) == 1:
+            return params[0]
         # Create a new class with these params.
         self = super().__new__(cls, name, bases, namespace, _root=True)
-        self.__union_params__ = tuple(t for t in params if t in all_params)
+        self.__union_params__ = tuple(params)
         self.__union_set_params__ = frozenset(self.__union_params__)
+        # Split the params into those whose instance check only
+        # depends on the class of the instance, and the rest.  The
+        # former are cached per class in __union_cache__.
+        self.__union_cached_params__ = tuple(
+            t for t in params if _type_determined(t))
+        other = [t for t in params if not _type_determined(t)]
+        tuples = [t for t in other
+                  if isinstance(t, (TupleMeta, _TupleAlias)) and
+                  t.__tuple_params__ is not None]
+        if len(tuples) > 1:
+            self.__union_dispatch__ = _TupleDispatch(tuples)
+            other = [t for t in other if t not in tuples]
+        else:
+            self.__union_dispatch__ = None
+        self.__union_other_params__ = tuple(other)
+        self.__union_vars__ = tuple(
+            t for t in self.__union_cached_params__ if isinstance(t, TypeVar))
+        self.__union_cache__ = _IdentityCache()
+        self.__union_cache_token__ = abc.get_cache_token()
+        self.__union_hits__ = {}
+        self.__union_checks__ = 0
         return self
 
     def __repr__(self):
@@ -359,8 +1111,12 @@ class UnionMeta(TypingMeta):
             raise TypeError("Cannot take a Union of no types.")
         if not isinstance(parameters, tuple):
             parameters = (parameters,)
-        return self.__class__(self.__name__, self.__bases__,
-                              dict(self.__dict__), parameters, _root=True)
+        parameters = tuple(map(_type_param, parameters))
+        return _type_cache.lookup(
+            self, parameters,
+            lambda: self.__class__(self.__name__, self.__bases__,
+                                   dict(self.__dict__), parameters,
+                                   _root=True))
 
     def __eq__(self, other):
         if not isinstance(other, UnionMeta):
@@ -371,9 +1127,66 @@ class UnionMeta(TypingMeta):
         return hash(self.__union_set_params__)
 
     def __instancecheck__(self, instance):
-        return any(isinstance(instance, t) for t in self.__union_params__)
-
+        if self.__union_params__ is None:
+            raise TypeError("Cannot use isinstance() with an "
+                            "unsubscripted Union.")
+        return self._match(instance) is not False
+
+    def _match(self, instance):
+        """Return the member that instance matches, or False."""
+        cls = type(instance)
+        if (instance.__class__ is not cls or
+            any(v.__binding__ is not None for v in self.__union_vars__)):
+            # Bound type variables and instances lying about their
+            # class bypass the cache.
+            return next((t for t in self.__union_params__
+                         if isinstance(instance, t)), False)
+        token = abc.get_cache_token()
+        if token != self.__union_cache_token__:
+            # An ABC was registered; any cached result may be stale.
+            self.__union_cache__.clear()
+            self.__union_cache_token__ = token
+        # The cache holds the member that matched, or False.
+        match = self.__union_cache__.get(cls)
+        if match is None:
+            match = next((t for t in self.__union_cached_params__
+                          if isinstance(instance, t)), False)
+            self.__union_cache__[cls] = match
+        if _adaptive_unions:
+            return self._counted_match(instance, match)
+        if match is False:
+            return self._match_other(instance)
+        return match
+
+    def _match_other(self, instance):
+        """Return the uncached member that instance matches, or False."""
+        if self.__union_dispatch__ is not None and isinstance(instance,
+                                                              tuple):
+            for t in self.__union_dispatch__.candidates(instance):
+                if isinstance(instance, t):
+                    return t
+        for t in self.__union_other_params__:
+            if isinstance(instance, t):
+                return t
+        return False
+
+    def _counted_match(self, instance, match):
+        """The end of _match() in adaptive mode."""
+        if match is False:
+            match = self._match_other(instance)
+        hits = self.__union_hits__
+        if match is not False:
+            hits[match] = hits.get(match, 0) + 1
+        self.__union_checks__ += 1
+        if not self.__union_checks__ % _UNION_REORDER_INTERVAL:
+            # A stable sort, so ties keep their current order.
+            self.__union_other_params__ = tuple(sorted(
+                self.__union_other_params__, key=lambda t: -hits.get(t, 0)))
+        return match
+
+    @_cached_subclasscheck
     def __subclasscheck__(self, cls):
+        cls = _resolved(cls)
         if self.__union_params__ is None:
             return isinstance(cls, UnionMeta)
         elif isinstance(cls, UnionMeta):
@@ -445,6 +1258,14 @@ class Union(Final, metaclass=UnionMeta, _root=True):
     # Unsubscripted Union type has params set to None.
     __union_params__ = None
     __union_set_params__ = None
+    __union_cached_params__ = None
+    __union_other_params__ = None
+    __union_dispatch__ = None
+    __union_vars__ = None
+    __union_cache__ = None
+    __union_cache_token__ = None
+    __union_hits__ = None
+    __union_checks__ = None
 
 
 class OptionalMeta(TypingMeta):
@@ -454,8 +1275,8 @@ class OptionalMeta(TypingMeta):
         return super().__new__(cls, name, bases, namespace, _root=_root)
 
     def __getitem__(self, arg):
-        if not isinstance(arg, type):
-            raise TypeError("Optional[t] requires a single type.")
+        arg = _type_check(_type_param(arg),
+                          "Optional[t] requires a single type.")
         return Union[arg, type(None)]
 
 
@@ -466,6 +1287,93 @@ class Optional(Final, metaclass=OptionalMeta, _root=True):
     """
 
 
+# How deeply isinstance() looks into containers; see set_validation().
+_VALIDATION_DEPTHS = ('shallow', 'first', 'sample', 'full')
+
+
+class _Validation:
+    """A validation setting: depth, count and random source."""
+
+    __slots__ = ('depth', 'count', 'seed', 'random')
+
+    def __init__(self, depth, count=None, seed=None):
+        if depth not in _VALIDATION_DEPTHS:
+            raise ValueError("Validation depth must be one of %s; got %r" %
+                             (', '.join(_VALIDATION_DEPTHS), depth))
+        if depth in ('first', 'sample'):
+            if not isinstance(count, int) or count < 0:
+                raise ValueError("Validation depth %r needs a count >= 0" %
+                                 depth)
+        self.depth = depth
+        self.count = count
+        self.seed = seed
+        self.random = random.Random(seed) if depth == 'sample' else None
+
+
+_validation = _Validation('full')
+_validation_var = contextvars.ContextVar('validation', default=None)
+
+
+def set_validation(depth, count=None, seed=None):
+    """Set how many elements isinstance() checks in containers.
+
+    This applies to the element checks of parameterized List, Dict,
+    Set and FrozenSet and of Tuple.  The depth is one of:
+
+    - 'shallow': only check the type of the container (and the length
+      of a tuple);
+    - 'first': check the first count elements;
+    - 'sample': check count elements at random positions, drawn from
+      random.Random(seed) so that a run can be reproduced.  Sets and
+      dicts can't be indexed, so for those the first count elements
+      are checked;
+    - 'full': check every element.  This is the default.
+
+    This sets the default for all threads; validation() overrides it
+    locally.  Return the previous setting as (depth, count, seed).
+    """
+    global _validation
+    previous = _validation
+    _validation = _Validation(depth, count, seed)
+    return previous.depth, previous.count, previous.seed
+
+
+@contextlib.contextmanager
+def validation(depth, count=None, seed=None):
+    """Use another validation depth in a with-block, e.g.::
+
+      with validation('sample', 100):
+          assert isinstance(rows, List[Tuple[int, str]])
+
+    See set_validation() for the arguments.  The setting is local to
+    the current thread or asyncio Task, like type variable bindings.
+    """
+    token = _validation_var.set(_Validation(depth, count, seed))
+    try:
+        yield
+    finally:
+        _validation_var.reset(token)
+
+
+def _checked_elements(container):
+    """Return (index, element) pairs of container to check.
+
+    Which ones depends on the current validation setting.
+    """
+    setting = _validation_var.get() or _validation
+    depth = setting.depth
+    if depth == 'full':
+        return enumerate(container)
+    if depth == 'shallow':
+        return ()
+    size = len(container)
+    if (depth == 'sample' and size > setting.count and
+            isinstance(container, (list, tuple))):
+        indices = sorted(setting.random.sample(range(size), setting.count))
+        return ((i, container[i]) for i in indices)
+    return itertools.islice(enumerate(container), setting.count)
+
+
 class TupleMeta(TypingMeta):
     """Metaclass for Tuple."""
 
@@ -475,11 +1383,13 @@ class TupleMeta(TypingMeta):
         return self
 
     def __repr__(self):
-        r = super().__repr__()
-        if self.__tuple_params__ is not None:
-            r += '[%s]' % (
-                ', '.join(_type_repr(p) for p in self.__tuple_params__))
-        return r
+        return super().__repr__() + self._params_repr()
+
+    def _params_repr(self):
+        if self.__tuple_params__ is None:
+            return ''
+        return '[%s]' % (
+            ', '.join(_type_repr(p) for p in self.__tuple_params__))
 
     def __getitem__(self, parameters):
         if self.__tuple_params__ is not None:
@@ -487,33 +1397,45 @@ class TupleMeta(TypingMeta):
         if not isinstance(parameters, tuple):
             parameters = (parameters,)
         msg = "Class[arg, ...]: each arg must be a type."
-        parameters = tuple(_type_check(p, msg) for p in parameters)
-        return self.__class__(self.__name__, self.__bases__,
-                              dict(self.__dict__), parameters, _root=True)
+        parameters = tuple(_type_check(_type_param(p), msg)
+                           for p in parameters)
+        if _compact_aliases:
+            return _type_cache.lookup(
+                _TupleAlias, parameters,
+                lambda: _TupleAlias(self, parameters))
+        return _type_cache.lookup(
+            self, parameters,
+            lambda: self.__class__(self.__name__, self.__bases__,
+                                   dict(self.__dict__), parameters,
+                                   _root=True))
 
     def __instancecheck__(self, t):
         if not isinstance(t, tuple):
             return False
-        if self.__tuple_params__ is None:
+        params = self.__tuple_params__
+        if params is None:
             return True
-        return (len(t) == len(self.__tuple_params__) and
-                all(isinstance(x, p)
-                    for x, p in zip(t, self.__tuple_params__)))
+        return (len(t) == len(params) and
+                all(isinstance(x, params[i])
+                    for i, x in _checked_elements(t)))
 
+    @_cached_subclasscheck
     def __subclasscheck__(self, cls):
-        if not isinstance(cls, type):
-            return super().__subclasscheck__(cls)  # To TypeError.
-        if issubclass(cls, tuple):
+        # This also serves _TupleAlias, so no super() calls.
+        if not isinstance(cls, (type, _TypeAlias)):
+            raise TypeError("issubclass() arg 1 must be a class")
+        cls = _resolved(cls)
+        if isinstance(cls, type) and issubclass(cls, tuple):
             return True  # Special case.
-        if not isinstance(cls, TupleMeta):
-            return super().__subclasscheck__(cls)  # False.
+        if not isinstance(cls, (TupleMeta, _TupleAlias)):
+            return False
         if self.__tuple_params__ is None:
             return True
         if cls.__tuple_params__ is None:
             return False  # ???
         # Covariance.
         return (len(self.__tuple_params__) == len(cls.__tuple_params__) and
-                all(issubclass(x, p)
+                all(issubclass(_resolved(x), p)
                     for x, p in zip(cls.__tuple_params__,
                                     self.__tuple_params__)))
 
@@ -529,6 +1451,129 @@ class Tuple(Final, metaclass=TupleMeta, _root=True):
     """
 
 
+class _TupleAlias(_TypeAlias):
+    """Compact form of Tuple[...]."""
+
+    __slots__ = ('__tuple_params__',)
+
+    def __init__(self, origin, parameters):
+        self.__origin__ = origin
+        self.__tuple_params__ = parameters
+
+
+class _CallableSignature:
+    """What Callable[...] checks need to know about a callable.
+
+    This is computed from inspect.getfullargspec() once per function
+    and cached in a table keyed weakly on the function; bound methods
+    share the entry of their __func__.  An entry is recomputed if the
+    function's code, defaults or annotations have been replaced.
+    """
+
+    __slots__ = ['names', 'varargs', 'num_defaults', 'kwonly_required',
+                 'annotations', '_source']
+
+    _cache = weakref.WeakKeyDictionary()
+
+    def __init__(self, argspec, globalns=None, source=None):
+        (args, varargs, varkw, defaults, kwonlyargs, kwonlydefaults,
+         annotations) = argspec
+        self.names = tuple(args)
+        self.varargs = varargs
+        self.num_defaults = len(defaults) if defaults else 0
+        self.kwonly_required = bool(kwonlyargs) and (
+            not kwonlydefaults or len(kwonlydefaults) < len(kwonlyargs))
+        # Resolve what we can now; anything that isn't a type is kept
+        # as is so that matches() can complain about it.  Strings are
+        # forward references in the function's module.
+        self.annotations = {}
+        for name, annot in annotations.items():
+            if annot is None:
+                annot = type(None)
+            elif isinstance(annot, str) and globalns is not None:
+                annot = _forward_ref(annot, globalns)
+            self.annotations[name] = annot
+        self._source = source
+
+    @classmethod
+    def get(cls, func):
+        """Return the signature of func, or None if there is none."""
+        if isinstance(func, types.MethodType):
+            target = func.__func__
+        else:
+            target = func
+        if not isinstance(target, types.FunctionType):
+            # Not worth caching (or not weakly referenceable).
+            try:
+                return cls(inspect.getfullargspec(func),
+                           getattr(target, '__globals__', None))
+            except TypeError:
+                return None
+        source = (target.__code__, target.__defaults__,
+                  target.__kwdefaults__, target.__annotations__)
+        sig = cls._cache.get(target)
+        if sig is None or not all(a is b for a, b in zip(sig._source,
+                                                         source)):
+            try:
+                sig = cls(inspect.getfullargspec(target), target.__globals__,
+                          source)
+            except TypeError:
+                return None
+            cls._cache[target] = sig
+        return sig
+
+    def matches(self, my_args, my_result, bound=False):
+        """Check against Callable[my_args, my_result].
+
+        If bound is true the first argument is dropped, as it is
+        supplied by a bound method.
+        """
+        if self.kwonly_required:
+            return False
+        names = self.names[1:] if bound else self.names
+        min_call_args = len(names) - self.num_defaults
+        if self.varargs:
+            max_call_args = 999999999
+            if len(names) < len(my_args):
+                names += (self.varargs,) * (len(my_args) - len(names))
+        else:
+            max_call_args = len(names)
+        if not min_call_args <= len(my_args) <= max_call_args:
+            return False
+        msg = ("When testing isinstance(<callable>, Callable[...], " +
+               "<calleble>'s annotations must be types.")
+        annotations = self.annotations
+        for my_arg_type, name in zip(my_args, names):
+            annot_type = annotations.get(name, Any)
+            if not isinstance(annot_type, type):
+                _type_check(annot_type, msg)
+            if not issubclass(_resolved(my_arg_type), annot_type):
+                return False
+            # TODO: If mutable type, check invariance?
+        if 'return' in annotations:
+            annot_return_type = _type_check(annotations['return'], msg)
+            # Note contravariance here!
+            if not issubclass(_resolved(annot_return_type), my_result):
+                return False
+        # Can't find anything wrong...
+        return True
+
+
+def _callable_params(args, result):
+    """Check the parameters of Callable[args, result].
+
+    Return them as a tuple of argument types and a result type.
+    """
+    if not isinstance(args, list):
+        TypeError("Callable[args, result]: args must be a list." +
+                  " Got %.100r." % (args,))
+    msg = "Callable[[arg, ...], result]: each arg must be a type."
+    args = tuple(_type_check(arg, msg) for arg in args)
+    msg = "Callable[args, result]: result must be a type."
+    result = _type_check(result, msg)
+    return args, result
+
+
 class CallableMeta(TypingMeta):
     """Metaclass for Callable."""
 
@@ -537,26 +1582,21 @@ class CallableMeta(TypingMeta):
         if args is None and result is None:
             pass  # Must be 'class Callable'.
         else:
-            if not isinstance(args, list):
-                TypeError("Callable[args, result]: args must be a list." +
-                          " Got %.100r." % (args,))
-            msg = "Callable[[arg, ...], result]: each arg must be a type."
-            args = tuple(_type_check(arg, msg) for arg in args)
-            msg = "Callable[args, result]: result must be a type."
-            result = _type_check(result, msg)
+            args, result = _callable_params(args, result)
         self = super().__new__(cls, name, bases, namespace, _root=_root)
         self.__args__ = args
         self.__result__ = result
         return self
 
     def __repr__(self):
-        r = super().__repr__()
-        if self.__args__ is not None or self.__result__ is not None:
-            r += '%s[[%s], %s]' % (self.__qualname__,
-                                   ', '.join(_type_repr(t)
-                                             for t in self.__args__),
-                                   _type_repr(self.__result__))
-        return r
+        return super().__repr__() + self._params_repr()
+
+    def _params_repr(self):
+        if self.__args__ is None and self.__result__ is None:
+            return ''
+        return '[[%s], %s]' % (', '.join(_type_repr(t)
+                                         for t in self.__args__),
+                               _type_repr(self.__result__))
 
     def __getitem__(self, parameters):
         if self.__args__ is not None or self.__result__ is not None:
@@ -565,12 +1605,29 @@ class CallableMeta(TypingMeta):
             raise TypeError(
                 "Callable must be used as Callable[[arg, ...], result].")
         args, result = parameters
-        return self.__class__(self.__name__, self.__bases__,
-                              dict(self.__dict__), _root=True,
-                              args=args, result=result)
+        if not isinstance(args, list):
+            # Let __new__() complain.
+            return self.__class__(self.__name__, self.__bases__,
+                                  dict(self.__dict__), _root=True,
+                                  args=args, result=result)
+        args = list(map(_type_param, args))
+        result = _type_param(result)
+        # The result is always last, so the arguments can be flattened
+        # into the key without ambiguity.
+        if _compact_aliases:
+            return _type_cache.lookup(
+                _CallableAlias, tuple(args) + (result,),
+                lambda: _CallableAlias(self, args, result))
+        return _type_cache.lookup(
+            self, tuple(args) + (result,),
+            lambda: self.__class__(self.__name__, self.__bases__,
+                                   dict(self.__dict__), _root=True,
+                                   args=args, result=result))
 
     def __eq__(self, other):
-        if not isinstance(other, CallableMeta):
+        # This also serves _CallableAlias, which compares equal to the
+        # class form with the same parameters.
+        if not isinstance(other, (CallableMeta, _CallableAlias)):
             return NotImplemented
         return (self.__args__ == other.__args__ and
                 self.__result__ == other.__result__)
@@ -585,53 +1642,21 @@ class CallableMeta(TypingMeta):
             return True
         assert self.__args__ is not None
         assert self.__result__ is not None
-        my_args, my_result = self.__args__, self.__result__
-        # Would it be better to use Signature objects?
-        try:
-            (args, varargs, varkw, defaults, kwonlyargs, kwonlydefaults,
-             annotations) = inspect.getfullargspec(instance)
-        except TypeError:
+        sig = _CallableSignature.get(instance)
+        if sig is None:
             return False  # We can't find the signature.  Give up.
-        if kwonlyargs and (not kwonlydefaults or
-                           len(kwonlydefaults) < len(kwonlyargs)):
-            return False
-        if isinstance(instance, types.MethodType):
-            # For methods, getfullargspec() includes self/cls,
-            # but it's not part of the call signature, so drop it.
-            del args[0]
-        min_call_args = len(args)
-        if defaults:
-            min_call_args -= len(defaults)
-        if varargs:
-            max_call_args = 999999999
-            if len(args) < len(my_args):
-                args += [varargs] * (len(my_args) - len(args))
-        else:
-            max_call_args = len(args)
-        if not min_call_args <= len(my_args) <= max_call_args:
-            return False
-        msg = ("When testing isinstance(<callable>, Callable[...], " +
-               "<calleble>'s annotations must be types.")
-        for my_arg_type, name in zip(my_args, args):
-            if name in annotations:
-                annot_type = _type_check(annotations[name], msg)
-            else:
-                annot_type = Any
-            if not issubclass(my_arg_type, annot_type):
-                return False
-            # TODO: If mutable type, check invariance?
-        if 'return' in annotations:
-            annot_return_type = _type_check(annotations['return'], msg)
-            # Note contravariance here!
-            if not issubclass(annot_return_type, my_result):
-                return False
-        # Can't find anything wrong...
-        return True
+        # For methods, getfullargspec() includes self/cls,
+        # but it's not part of the call signature, so drop it.
+        return sig.matches(self.__args__, self.__result__,
+                           isinstance(instance, types.MethodType))
 
     def __subclasscheck__(self, cls):
-        # Compute issubclass(cls, self).
-        if not isinstance(cls, CallableMeta):
-            return super().__subclasscheck__(cls)
+        # Compute issubclass(cls, self).  This also serves
+        # _CallableAlias, so no super() calls.
+        if not isinstance(cls, (CallableMeta, _CallableAlias)):
+            if not isinstance(cls, (type, _TypeAlias)):
+                raise TypeError("issubclass() arg 1 must be a class")
+            return False
         if self.__args__ is None and self.__result__ is None:
             return True
         # We're not doing covariance or contravariance -- this is *invariance*.
@@ -650,8 +1675,70 @@ class Callable(Final, metaclass=CallableMeta, _root=True):
     """
 
 
+class _CallableAlias(_TypeAlias):
+    """Compact form of Callable[[...], ...]."""
+
+    __slots__ = ('__args__', '__result__')
+
+    def __init__(self, origin, args, result):
+        self.__origin__ = origin
+        self.__args__, self.__result__ = _callable_params(args, result)
+
+    __eq__ = CallableMeta.__eq__
+    __hash__ = CallableMeta.__hash__
+
+
+# Forward declarations of generic classes waiting for their
+# definition, keyed by (module name, qualified name).
+_pending_declarations = {}
+
+# Extras of the generic classes that check elements; see GenericMeta.
+_ELEMENT_CONTAINERS = (list, set, frozenset, dict)
+
+
+def _element_type(t):
+    """Return t, or None if element checks against t always pass."""
+    if t is Any or t is object:
+        return None
+    if (isinstance(t, TypeVar) and not t.__constraints__ and
+            t.__binding__ is None):
+        return None  # Like List[T] in a generic function.
+    return t
+
+
 class GenericMeta(TypingMeta, abc.ABCMeta):
-    """Metaclass for generic types."""
+    """Metaclass for generic types.
+
+    A generic class can be declared before it is defined, so that it
+    can be used in annotations of its own body or of other classes::
+
+      class Node(Generic[T], forward=True):
+          pass
+
+      class Node(Generic[T]):
+          def add_left(self, node: Optional[Node[T]]): ...
+
+    The second class statement completes the declared class in place
+    rather than creating a new one.  It must be in the same module,
+    have the same qualified name, bases and parameters.
+
+    The keyword argument extra names a class (or tuple of classes)
+    whose subclasses count as subclasses of the new class, the way
+    list counts as a List.  It is kept as __extra__ and applies to
+    the class and its parameterizations, not to its subclasses.
+
+    A subscription such as List[int] records the class it was made
+    from as __origin__ (None for classes made by a class statement).
+    Subscribing a subscription, e.g. substituting int for T in
+    Dict[str, T], subscribes its origin, so Dict[str, T][str, int] is
+    Dict[str, int].
+
+    Parameterizations of classes whose extra is one of list, set,
+    frozenset and dict also check the elements of instances, e.g.
+    isinstance([1, ''], List[int]) is False.  The parameters used for
+    that are kept as __element_params__ (None for all other classes);
+    set_validation() controls how many elements are looked at.
+    """
 
     # TODO: Constrain more how Generic is used; only a few
     # standard patterns should be allowed.
@@ -659,7 +1746,11 @@ class GenericMeta(TypingMeta, abc.ABCMeta):
     # TODO: Somehow repr() of a subclass parameterized comes out with
     # module=typing.
 
-    def __new__(cls, name, bases, namespace, parameters=None):
+    def __new__(cls, name, bases, namespace, parameters=None,
+                forward=False, extra=None, origin=None):
+        if extra is not None:
+            namespace = dict(namespace, __extra__=extra)
+        subscripted = parameters is not None
         if parameters is None:
             # Extract parameters from direct base classes.  Only
             # direct bases are considered and only those that are
@@ -688,21 +1779,34 @@ class GenericMeta(TypingMeta, abc.ABCMeta):
                             params.append(bp)
             if params is not None:
                 parameters = tuple(params)
-
-        # Check the caller's locals to see if we're overriding a
-        # forward reference.  If so, update the class in place.
-        f = sys._getframe(1)
-        if f.f_locals and name in f.f_locals:
-            overriding = f.f_locals[name]
-            if (isinstance(overriding, cls) and
-                overriding.__bases__ == bases and
-                overriding.__parameters__ == parameters):
-                self = overriding
-                for k, v in namespace.items():
-                    setattr(self, k, v)
-                return self
+            # A class statement may complete a forward declaration.
+            # Subscriptions always pass parameters, so they never do.
+            if _pending_declarations and not forward:
+                key = (namespace.get('__module__'),
+                       namespace.get('__qualname__', name))
+                declared = _pending_declarations.pop(key, None)
+                if declared is not None:
+                    if not (isinstance(declared, cls) and
+                            declared.__bases__ == bases and
+                            declared.__parameters__ == parameters):
+                        raise TypeError(
+                            "%s doesn't match its forward declaration" %
+                            key[1])
+                    # Parameterizations made meanwhile copied the
+                    # stub's namespace; they get the body as well.
+                    for target in [declared] + _type_cache.results(declared):
+                        for k, v in namespace.items():
+                            setattr(target, k, v)
+                    return declared
         self = super().__new__(cls, name, bases, namespace, _root=True)
         self.__parameters__ = parameters
+        self.__origin__ = origin
+        if subscripted and namespace.get('__extra__') in _ELEMENT_CONTAINERS:
+            self.__element_params__ = parameters
+        else:
+            self.__element_params__ = None
+        if forward:
+            _pending_declarations[self.__module__, self.__qualname__] = self
         return self
 
     def __repr__(self):
@@ -721,13 +1825,37 @@ class GenericMeta(TypingMeta, abc.ABCMeta):
     def __hash__(self):
         return hash((self.__name__, self.__parameters__))
 
+    def __instancecheck__(self, instance):
+        if not super().__instancecheck__(instance):
+            return False
+        params = self.__element_params__
+        if params is None:
+            return True
+        if len(params) == 2:
+            key_type, value_type = map(_element_type, params)
+            return all((key_type is None or isinstance(k, key_type)) and
+                       (value_type is None or isinstance(v, value_type))
+                       for _, (k, v) in _checked_elements(instance.items()))
+        element_type = _element_type(params[0])
+        if element_type is None:
+            return True
+        return all(isinstance(x, element_type)
+                   for _, x in _checked_elements(instance))
+
+    def __subclasscheck__(self, cls):
+        cls = _resolved(cls)
+        extra = self.__dict__.get('__extra__')
+        if extra is not None and issubclass(cls, extra):
+            return True
+        return super().__subclasscheck__(cls)
+
     def __getitem__(self, params):
         if not isinstance(params, tuple):
             params = (params,)
         if not params:
             raise TypeError("Cannot have empty parameter list")
         msg = "Parameters to generic types must be types."
-        params = tuple(_type_check(p, msg) for p in params)
+        params = tuple(_type_check(_type_param(p), msg) for p in params)
         if self.__parameters__ is None:
             for p in params:
                 if not isinstance(p, TypeVar):
@@ -741,13 +1869,18 @@ class GenericMeta(TypingMeta, abc.ABCMeta):
                 if isinstance(old, TypeVar) and not old.__constraints__:
                     # Substituting for an unconstrained TypeVar is always OK.
                     continue
+                if isinstance(new, _ForwardRef):
+                    continue  # Can't check this yet.
                 if not issubclass(new, old):
                     raise TypeError(
                         "Cannot substitute %s for %s in %s" %
                         (_type_repr(new), _type_repr(old), self))
-        return self.__class__(self.__name__, self.__bases__,
-                              dict(self.__dict__),
-                              parameters=params)
+        origin = self.__origin__ or self
+        return _type_cache.lookup(
+            origin, params,
+            lambda: origin.__class__(origin.__name__, origin.__bases__,
+                                     dict(origin.__dict__),
+                                     parameters=params, origin=origin))
 
 
 class Generic(metaclass=GenericMeta):
@@ -779,6 +1912,129 @@ class Generic(metaclass=GenericMeta):
     """
 
 
+# Names in a protocol class body that are not protocol members.
+_PROTOCOL_IGNORED = frozenset([
+    '__module__', '__qualname__', '__doc__', '__dict__', '__weakref__',
+    '__annotations__', '__slots__', '__init__', '__new__',
+    '__init_subclass__', '__subclasshook__', '__abstractmethods__',
+    '__parameters__', '__origin__', '__element_params__', '__extra__',
+    '__protocol_members__',
+    '__protocol_cache__', '__protocol_cache_token__', '_abc_impl',
+])
+
+
+class ProtocolMeta(GenericMeta):
+    """Metaclass for Protocol and protocol classes.
+
+    A class is a protocol if Protocol or Protocol[...] is among its
+    direct bases.  The members it requires are collected once when it
+    is created: everything defined in its body and the bodies of the
+    protocols it derives from, except for the special names in
+    _PROTOCOL_IGNORED.  Attributes that are only annotated are not
+    required, since they usually live on the instances.
+
+    A class conforms if every member is found in its MRO and is not
+    None, and every member that is callable in the protocol is
+    callable in the class.  The verdict, or whether the class is a
+    subclass of the protocol anyway, is cached per class in a weak
+    dictionary that is cleared when an ABC is registered, so changes
+    to the class after its first check go unnoticed.
+    """
+
+    def __new__(cls, name, bases, namespace, parameters=None, **kwds):
+        if parameters is None and '__protocol_members__' not in namespace:
+            # Protocol and its parameterizations are the only protocol
+            # classes without members.
+            if any(b.__dict__.get('__protocol_members__') == ()
+                   for b in bases):
+                namespace = dict(namespace,
+                                 __protocol_members__=_protocol_members(
+                                     name, bases, namespace))
+            else:
+                namespace = dict(namespace, __protocol_members__=None)
+        self = super().__new__(cls, name, bases, namespace, parameters,
+                               **kwds)
+        if self.__protocol_members__:
+            self.__protocol_cache__ = _IdentityCache()
+            self.__protocol_cache_token__ = abc.get_cache_token()
+        return self
+
+    def __instancecheck__(self, instance):
+        if not self.__dict__.get('__protocol_members__'):
+            return super().__instancecheck__(instance)
+        return self.__subclasscheck__(type(instance))
+
+    def __subclasscheck__(self, cls):
+        if not self.__dict__.get('__protocol_members__'):
+            return super().__subclasscheck__(cls)
+        cls = _resolved(cls)
+        token = abc.get_cache_token()
+        if token != self.__protocol_cache_token__:
+            self.__protocol_cache__.clear()
+            self.__protocol_cache_token__ = token
+        result = self.__protocol_cache__.get(cls)
+        if result is not None:
+            return result
+        result = (_conforms(cls, self.__protocol_members__) or
+                  super().__subclasscheck__(cls))
+        self.__protocol_cache__[cls] = result
+        return result
+
+
+def _protocol_members(name, bases, namespace):
+    """Return the members a new protocol requires, as a tuple of
+    (name, whether it must be callable) pairs."""
+    members = {}
+    for base in bases:
+        base_members = base.__dict__.get('__protocol_members__')
+        if base_members is None:
+            if base is not object and not isinstance(base, GenericMeta):
+                raise TypeError("Protocol %s can only inherit from "
+                                "protocols, not %s" %
+                                (name, _type_repr(base)))
+            continue
+        members.update(base_members)
+    for key, value in namespace.items():
+        if key not in _PROTOCOL_IGNORED and not key.startswith('_abc_'):
+            members[key] = callable(value)
+    return tuple(sorted(members.items()))
+
+
+def _conforms(cls, members):
+    """Return whether cls has all the protocol members."""
+    mro = cls.__mro__
+    for name, must_call in members:
+        for base in mro:
+            if name in base.__dict__:
+                value = base.__dict__[name]
+                break
+        else:
+            return False
+        if value is None or (must_call and not callable(value)):
+            return False
+    return True
+
+
+class Protocol(metaclass=ProtocolMeta):
+    """Base class for protocol classes.
+
+    Protocol classes describe a set of members structurally; a class
+    doesn't have to derive from one to be considered its subclass::
+
+      class SupportsClose(Protocol):
+          def close(self): ...
+
+      isinstance(open('spam'), SupportsClose)  # True
+
+    Protocols can be generic, e.g. class SupportsAbs(Protocol[T]),
+    and can extend other protocols by listing them and Protocol as
+    bases.  A class that derives from a protocol without listing
+    Protocol is an ordinary class.
+    """
+
+    __protocol_members__ = ()
+
+
 class Undefined:
     """An undefined value.
 
@@ -818,3 +2074,1317 @@ def cast(typ, val):
     """
     _type_check(typ, "cast(t, v): t must be a type.")
     return val
+
+
+# Results of substitute() by the ids of the template and of the
+# (variable, value) pairs, least recently used first.  Unlike the
+# intern tables these hold strong references, so that a result that
+# nobody keeps isn't rebuilt by the next call; the entries also hold
+# their arguments, which keeps the ids valid.
+_SUBSTITUTION_CACHE_SIZE = 1024
+_substitutions = collections.OrderedDict()
+# Guards _substitutions, which is shared between threads.  It isn't
+# held while a result is computed, since that may recurse.
+_substitutions_lock = threading.Lock()
+
+
+def substitute(typ, mapping):
+    """Replace type variables throughout a type expression.
+
+    The mapping maps type variables to types, e.g.
+
+        substitute(Tuple[T, Callable[[T], KT]], {T: int, KT: str})
+
+    returns Tuple[int, Callable[[int], str]].  Unions, tuples,
+    callables and generic classes are rewritten at any depth; a
+    generic class is re-subscribed from its origin, so substituting
+    in List[T] gives List[int] itself.  A value must satisfy the
+    constraints of its variable.  Variables missing from the mapping
+    are left alone, and strings are taken as forward references.
+
+    Subexpressions that don't change are returned as is rather than
+    rebuilt, and the most recent results are cached per template and
+    mapping, so specializing the same template again is a single
+    lookup.
+    """
+    raw = tuple(mapping.items())
+    # Strings resolve in the caller's module, so only mappings
+    # without them can be looked up as given.
+    for var, value in raw:
+        if isinstance(value, str):
+            return _substitute_mapping(typ, raw)
+    return _cached_substitution(typ, raw,
+                                lambda: _substitute_mapping(typ, raw))
+
+
+def _substitute_mapping(typ, raw):
+    items = []
+    for var, value in raw:
+        if not isinstance(var, TypeVar):
+            raise TypeError("substitute(t, mapping): mapping keys must be "
+                            "type variables. Got %.100r." % (var,))
+        value = _type_check(_type_param(value),
+                            "substitute(t, mapping): mapping values "
+                            "must be types.")
+        if (var.__constraints__ and not isinstance(value, _ForwardRef) and
+                not issubclass(value, var)):
+            raise TypeError("Cannot substitute %s for %s" %
+                            (_type_repr(value), _type_repr(var)))
+        items.append((var, value))
+    items.sort(key=lambda item: id(item[0]))
+    return _substitute(typ, tuple(items))
+
+
+def _cached_substitution(t, items, compute):
+    key = (id(t),) + tuple(map(id, itertools.chain.from_iterable(items)))
+    with _substitutions_lock:
+        entry = _substitutions.get(key)
+        if entry is not None:
+            _substitutions.move_to_end(key)
+            return entry[2]
+    result = compute()
+    with _substitutions_lock:
+        _substitutions[key] = (t, items, result)
+        _substitutions.move_to_end(key)
+        if len(_substitutions) > _SUBSTITUTION_CACHE_SIZE:
+            _substitutions.popitem(last=False)
+    return result
+
+
+def _substitute(t, items):
+    if not items:
+        return t
+    return _cached_substitution(t, items,
+                                lambda: _substitute_uncached(t, items))
+
+
+def _substitute_uncached(t, items):
+    if isinstance(t, TypeVar):
+        for var, value in items:
+            if var is t:
+                return value
+        return t
+    if isinstance(t, UnionMeta):
+        params = t.__union_params__
+    elif isinstance(t, (TupleMeta, _TupleAlias)):
+        params = t.__tuple_params__
+    elif isinstance(t, (CallableMeta, _CallableAlias)):
+        params = t.__args__ and t.__args__ + (t.__result__,)
+    elif isinstance(t, GenericMeta):
+        params = t.__parameters__
+    else:
+        params = None
+    if not params:
+        return t
+    new_params = tuple(_substitute(p, items) for p in params)
+    if all(new is old for new, old in zip(new_params, params)):
+        return t
+    if isinstance(t, UnionMeta):
+        return Union[new_params]
+    if isinstance(t, (TupleMeta, _TupleAlias)):
+        return Tuple[new_params]
+    if isinstance(t, (CallableMeta, _CallableAlias)):
+        return Callable[list(new_params[:-1]), new_params[-1]]
+    return (t.__origin__ or t)[new_params]
+
+
+class TypeUniverse:
+    """A registry of classes that makes union algebra bitwise.
+
+    Each registered class gets a bit, in order of registration, and
+    each type is summarized by the set of registered classes that are
+    its subclasses, as an int.  For unions made of registered classes
+    that summary is exact, so
+
+        universe = TypeUniverse([Read, Write, Admin])
+        universe.issubclass(Union[Read, Write], Union[Write, Admin, Read])
+        universe.union(Union[Read, Write], Admin)
+        universe.intersection(Union[Read, Write], Union[Write, Admin])
+
+    reduce to integer operations on cached bitsets.  Classes can also
+    be added later with register(), which works as a class decorator.
+
+    Types outside the universe fall back to the usual logic:
+    issubclass() and Union[] for subclass tests and unions, and for
+    intersections the members of each argument that are subclasses
+    of all the others.  Summaries are only kept for types whose
+    subclass checks depend on the class alone (no type variables,
+    elements or the like), and are dropped when an ABC is registered.
+    """
+
+    def __init__(self, classes=()):
+        self._classes = []
+        self._index = {}  # {class: bit number}
+        self._entries = {}  # {id(type): (weakref to type, (bits, inside))}
+        self._types = {}  # {bits: type}
+        self._remove = self._remove_entry
+        self._token = abc.get_cache_token()
+        for cls in classes:
+            self.register(cls)
+
+    def register(self, cls):
+        """Add a class to the universe and return it."""
+        if not isinstance(cls, type) or isinstance(cls, TypingMeta):
+            raise TypeError("TypeUniverse.register(cls): cls must be a "
+                            "plain class. Got %.100r." % (cls,))
+        if cls not in self._index:
+            self._index[cls] = len(self._classes)
+            self._classes.append(cls)
+            self._entries.clear()
+            self._types.clear()
+        return cls
+
+    def __contains__(self, cls):
+        return cls in self._index
+
+    def __len__(self):
+        return len(self._classes)
+
+    def _remove_entry(self, ref):
+        entry = self._entries.get(ref.key)
+        if entry is not None and entry[0] is ref:
+            del self._entries[ref.key]
+
+    def _lookup(self, t):
+        """Return (bits, inside) for t.
+
+        bits is None if t's subclasses don't depend on the class
+        alone; inside says whether t is a registered class or a union
+        of them.
+        """
+        token = abc.get_cache_token()
+        if token != self._token:
+            self._entries.clear()
+            self._types.clear()
+            self._token = token
+        entry = self._entries.get(id(t))
+        if entry is not None and entry[0]() is t:
+            return entry[1]
+        value = self._summarize(t)
+        try:
+            self._entries[id(t)] = (
+                weakref.KeyedRef(t, self._remove, id(t)), value)
+        except TypeError:
+            pass  # None, or not a type at all.
+        return value
+
+    def _summarize(self, t):
+        t = _type_check(t, "TypeUniverse: arguments must be types.")
+        if isinstance(t, UnionMeta) and t.__union_params__ is not None:
+            bits, inside = 0, True
+            for p in t.__union_params__:
+                p_bits, p_inside = self._lookup(p)
+                if p_bits is None:
+                    return None, False
+                bits |= p_bits
+                inside = inside and p_inside
+            return bits, inside
+        if not _class_determined(t):
+            return None, False
+        bits = 0
+        for i, cls in enumerate(self._classes):
+            if issubclass(cls, t):
+                bits |= 1 << i
+        return bits, t in self._index
+
+    def _type(self, bits):
+        """Return the union of the registered classes in bits."""
+        result = self._types.get(bits)
+        if result is None:
+            result = Union[tuple(cls for i, cls in enumerate(self._classes)
+                                 if bits >> i & 1)]
+            self._types[bits] = result
+        return result
+
+    def bits(self, t):
+        """Return the registered subclasses of t as a bitset.
+
+        Bit i is set if the i-th registered class is a subclass of t.
+        """
+        bits, inside = self._lookup(t)
+        if bits is None:
+            raise TypeError("%s has no bitset, since its subclasses don't "
+                            "depend on the class alone" % _type_repr(t))
+        return bits
+
+    def issubclass(self, t1, t2):
+        """Return issubclass(t1, t2), bitwise if t1 is in the universe."""
+        bits1, inside = self._lookup(t1)
+        if inside:
+            bits2 = self._lookup(t2)[0]
+            if bits2 is not None:
+                return not bits1 & ~bits2
+        return issubclass(t1, t2)
+
+    def union(self, *types):
+        """Return Union[types], bitwise if they are all in the universe."""
+        bits = 0
+        for t in types:
+            t_bits, inside = self._lookup(t)
+            if not inside:
+                return Union[types]
+            bits |= t_bits
+        return self._type(bits)
+
+    def intersection(self, *types):
+        """Return the union of the classes that are subclasses of all types.
+
+        Within the universe these are the registered classes that are
+        subclasses of every argument; otherwise the members of each
+        argument that are subclasses of all the others.  Returns None
+        if there are none.
+        """
+        if not types:
+            raise TypeError("intersection() takes at least one type")
+        bits = -1
+        for t in types:
+            t_bits, inside = self._lookup(t)
+            if not inside:
+                return self._intersection(types)
+            bits &= t_bits
+        return self._type(bits) if bits else None
+
+    def _intersection(self, types):
+        common = []
+        for t in types:
+            t = _type_check(t, "TypeUniverse: arguments must be types.")
+            members = (t.__union_params__ if isinstance(t, UnionMeta)
+                       else None) or (t,)
+            common.extend(m for m in members
+                          if all(issubclass(m, other) for other in types))
+        return Union[tuple(common)] if common else None
+
+
+# Generic versions of the collections.abc classes, the concrete
+# collections and a few other library types.  Creating them costs
+# several times as much as importing the rest of this module, so each
+# is only created when it is first looked up; see __getattr__() below.
+# Each entry returns the bases of the class and its extra (see
+# GenericMeta).  Bases that are lazy themselves must be looked up
+# with __getattr__(), since code in this module doesn't go through it.
+_LAZY_TYPES = {
+    'Hashable': lambda: ((), collections.abc.Hashable),
+    'Sized': lambda: ((), collections.abc.Sized),
+    'Iterable': lambda: ((Generic[T],), collections.abc.Iterable),
+    'Iterator': lambda: ((__getattr__('Iterable')[T],),
+                         collections.abc.Iterator),
+    'Container': lambda: ((Generic[T],), collections.abc.Container),
+    'AbstractSet': lambda: ((__getattr__('Sized'),
+                             __getattr__('Iterable')[T],
+                             __getattr__('Container')[T]),
+                            collections.abc.Set),
+    'MutableSet': lambda: ((__getattr__('AbstractSet')[T],),
+                           collections.abc.MutableSet),
+    'Mapping': lambda: ((__getattr__('Sized'),
+                         __getattr__('Iterable')[KT],
+                         __getattr__('Container')[KT],
+                         Generic[KT, VT]),
+                        collections.abc.Mapping),
+    'MutableMapping': lambda: ((__getattr__('Mapping')[KT, VT],),
+                               collections.abc.MutableMapping),
+    'MappingView': lambda: ((__getattr__('Sized'),
+                             __getattr__('Iterable')[T]),
+                            collections.abc.MappingView),
+    'KeysView': lambda: ((__getattr__('MappingView')[KT],
+                          __getattr__('AbstractSet')[KT]),
+                         collections.abc.KeysView),
+    'ItemsView': lambda: ((__getattr__('MappingView')[KT],
+                           Generic[KT, VT]),
+                          collections.abc.ItemsView),
+    'ValuesView': lambda: ((__getattr__('MappingView')[VT],),
+                           collections.abc.ValuesView),
+    'Sequence': lambda: ((__getattr__('Sized'),
+                          __getattr__('Iterable')[T],
+                          __getattr__('Container')[T]),
+                         collections.abc.Sequence),
+    'MutableSequence': lambda: ((__getattr__('Sequence')[T],),
+                                collections.abc.MutableSequence),
+    'ByteString': lambda: ((__getattr__('Sequence')[int],),
+                           collections.abc.ByteString),
+    'List': lambda: ((list, __getattr__('MutableSequence')[T]), list),
+    'Dict': lambda: ((dict, __getattr__('MutableMapping')[KT, VT]), dict),
+    'Set': lambda: ((set, __getattr__('MutableSet')[T]), set),
+    'FrozenSet': lambda: ((frozenset, __getattr__('AbstractSet')[T]),
+                          frozenset),
+    'IO': lambda: ((Generic[AnyStr],), io.IOBase),
+    'BinaryIO': lambda: ((__getattr__('IO')[bytes],),
+                         (io.BufferedIOBase, io.RawIOBase)),
+    'TextIO': lambda: ((__getattr__('IO')[str],), io.TextIOBase),
+    'Match': lambda: ((Generic[AnyStr],), re.Match),
+    'Pattern': lambda: ((Generic[AnyStr],), re.Pattern),
+}
+
+
+def __getattr__(name):
+    """Create the lazy module attribute name on first use."""
+    try:
+        make = _LAZY_TYPES[name]
+    except KeyError:
+        raise AttributeError("module %r has no attribute %r" %
+                             (__name__, name)) from None
+    namespace = globals()
+    if name not in namespace:
+        bases, extra = make()
+        extras = extra if isinstance(extra, tuple) else (extra,)
+        doc = "Generic version of %s." % ' or '.join(map(_type_repr, extras))
+        cls = GenericMeta(name, bases,
+                          {'__module__': __name__, '__doc__': doc},
+                          extra=extra)
+        # Another thread may have got here first.
+        namespace.setdefault(name, cls)
+    return namespace[name]
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_TYPES))
+
+
+def compile_checker(typ):
+    """Return a function f such that f(x) == isinstance(x, typ).
+
+    The type expression is analyzed once and turned into the source
+    of a single flat lambda: checks that always pass (Any, object)
+    are dropped, union members that are classes are tested with one
+    isinstance() call on a tuple of classes (preceded by an exact
+    type lookup if some of them are ABCs), Tuple[...] compares
+    lengths and element types inline, and type variables read their
+    binding without going through the metaclass.  Everything else
+    (e.g. Callable[...] and generic classes) falls back to
+    isinstance().  Use this when the same type is checked many times.
+
+    The validation depth (see set_validation()) applies as it does to
+    isinstance(): a tuple that fails the inlined element checks while
+    the depth isn't 'full' is checked again with isinstance().
+    """
+    typ = _type_check(typ, "compile_checker(t): t must be a type.")
+    namespace = {}
+    source = _checker_source(typ, 'x', namespace)
+    if source is None:
+        source = 'True'
+    return eval('lambda x: ' + source, namespace)
+
+
+def _checker_source(typ, arg, namespace):
+    """Helper for compile_checker().
+
+    Return a Python expression checking isinstance(arg, typ), or
+    None if every object passes.  Objects that the expression refers
+    to are added to namespace.
+    """
+    def name(obj):
+        key = '_%d' % len(namespace)
+        namespace[key] = obj
+        return key
+
+    if typ is Any or typ is object:
+        return None
+    if isinstance(typ, TypeVar):
+        if typ.__constraints__:
+            unbound = _checker_source(Union[typ.__constraints__], arg,
+                                      namespace)
+        else:
+            unbound = 'False'
+        # A bound variable is (nearly) an alias for its binding.
+        var = name(typ.__binding_var__)
+        return '(%s(%s, %s) if %s.get() is not None else %s)' % (
+            name(_var_instancecheck), var, arg, var, unbound)
+    if isinstance(typ, UnionMeta) and typ.__union_params__ is not None:
+        classes = []
+        parts = []
+        for t in typ.__union_params__:
+            if isinstance(t, (TypeVar, UnionMeta, TupleMeta, _TupleAlias)):
+                part = _checker_source(t, arg, namespace)
+                if part is None:
+                    return None
+                parts.append(part)
+            elif t is object:
+                return None
+            else:
+                classes.append(t)
+        if classes:
+            exact = frozenset(
+                c for c in classes
+                if type(c).__instancecheck__ is type.__instancecheck__)
+            part = 'isinstance(%s, %s)' % (arg, name(tuple(classes)))
+            if exact and len(exact) < len(classes):
+                # Classes with a custom instance check (e.g. ABCs) can
+                # be slow; an exact match on the others settles it.
+                part = 'type(%s) in %s or %s' % (arg, name(exact), part)
+            parts.insert(0, part)
+        return '(%s)' % ' or '.join(parts)
+    if isinstance(typ, (TupleMeta, _TupleAlias)):
+        parts = ['isinstance(%s, tuple)' % arg]
+        if typ.__tuple_params__ is not None:
+            parts.append('len(%s) == %d' % (arg, len(typ.__tuple_params__)))
+            elements = []
+            for i, t in enumerate(typ.__tuple_params__):
+                part = _checker_source(t, '%s[%d]' % (arg, i), namespace)
+                if part is not None:
+                    elements.append(part)
+            if elements:
+                # Checking fewer elements can't turn a match into a
+                # mismatch, so only a mismatch needs the setting.
+                full = "(%s.get() or %s['_validation']).depth == 'full'" % (
+                    name(_validation_var), name(globals()))
+                parts.append('(%s or not %s and isinstance(%s, %s))' % (
+                    ' and '.join(elements), full, arg, name(typ)))
+        return '(%s)' % ' and '.join(parts)
+    return 'isinstance(%s, %s)' % (arg, name(typ))
+
+
+def _var_instancecheck(binding_var, instance):
+    return isinstance(instance, binding_var.get()[0])
+
+
+def typechecked(func):
+    """Decorator to check a function's arguments and result at runtime.
+
+    The annotations are read once, when the function is decorated,
+    and each is compiled into a checker (see compile_checker()).
+    String annotations are forward references, resolved on first use.  A
+    call then only runs the checkers of the annotated arguments that
+    were actually passed, and of the return value; a mismatch raises
+    TypeError.  Default values are checked once, up front.  As in a
+    type checker, a default of None makes the annotation Optional.
+
+    Example::
+
+      @typechecked
+      def greet(name: str, times: int = 1) -> str:
+          return ', '.join(['Hello ' + name] * times)
+
+      greet('Guido')  # OK
+      greet(42)  # TypeError
+    """
+    (args, varargs, varkw, defaults, kwonlyargs, kwonlydefaults,
+     annotations) = inspect.getfullargspec(func)
+    defaults = dict(zip(reversed(args), reversed(defaults or ())))
+    defaults.update(kwonlydefaults or {})
+    funcname = getattr(func, '__qualname__', repr(func))
+    globalns = getattr(func, '__globals__', None)
+    msg = "@typechecked: annotations must be types."
+
+    def plan(name):
+        # Return (name, type, checker), or None if anything goes.
+        if name not in annotations:
+            return None
+        typ = annotations[name]
+        if isinstance(typ, str) and globalns is not None:
+            typ = _forward_ref(typ, globalns)
+        typ = _type_check(typ, msg)
+        if name in defaults and defaults[name] is None:
+            typ = Optional[typ]
+        if typ is Any or typ is object:
+            return None
+        return name, typ, compile_checker(typ)
+
+    def fail(what, typ, value):
+        raise TypeError("%s(): %s must be %s, got %s" %
+                        (funcname, what, _type_repr(typ),
+                         _type_repr(type(value))))
+
+    plans = {name: plan(name) for name in args + kwonlyargs}
+    positional = [(i,) + plans[name] for i, name in enumerate(args)
+                  if plans[name]]
+    # Keyword arguments named like a positional-only parameter go to
+    # **kwargs, so they are checked against its annotation instead.
+    posonly = {name for name, param
+               in inspect.signature(func).parameters.items()
+               if param.kind is param.POSITIONAL_ONLY}
+    keyword = {name: p for name, p in plans.items() if name not in posonly}
+    extra_positional = plan(varargs) if varargs else None
+    extra_keyword = plan(varkw) if varkw else None
+    result_plan = plan('return')
+    for name, p in plans.items():
+        if p and name in defaults and not p[2](defaults[name]):
+            fail('default of argument %r' % name, p[1], defaults[name])
+    if not (positional or any(plans.values()) or extra_positional or
+            extra_keyword or result_plan):
+        return func
+    num_args = len(args)
+
+    @functools.wraps(func)
+    def wrapper(*call_args, **call_kwargs):
+        num_call_args = len(call_args)
+        for i, name, typ, check in positional:
+            if i < num_call_args and not check(call_args[i]):
+                fail('argument %r' % name, typ, call_args[i])
+        if extra_positional and num_call_args > num_args:
+            name, typ, check = extra_positional
+            for value in call_args[num_args:]:
+                if not check(value):
+                    fail('argument *%s' % name, typ, value)
+        for name, value in call_kwargs.items():
+            p = keyword.get(name, extra_keyword)
+            if p is not None and not p[2](value):
+                fail('argument %r' % name, p[1], value)
+        result = func(*call_args, **call_kwargs)
+        if result_plan and not result_plan[2](result):
+            fail('return value', result_plan[1], result)
+        return result
+
+    return wrapper
+
+
+class _Overload:
+    """The variants and dispatch table of an overloaded function.
+
+    Each variant is (function, signature, checks), where checks maps
+    the names of its annotated parameters to (kind, type, checker).
+    The table maps the ids of a tuple of argument types to the types
+    and the variant chosen for them, for calls without keyword
+    arguments whose choice only depended on those types.  Keying on
+    ids keeps distinct classes that compare equal apart, and holding
+    on to the types keeps the ids from being reused.  The table is
+    emptied when a variant is added and when an ABC is registered.
+    """
+
+    def __init__(self, name, variants=()):
+        self.name = name
+        self.variants = list(variants)
+        self.table = {}
+        self.token = abc.get_cache_token()
+
+    def add(self, func):
+        signature = inspect.signature(func)
+        globalns = getattr(func, '__globals__', None)
+        checks = {}
+        for name, param in signature.parameters.items():
+            typ = param.annotation
+            if typ is param.empty:
+                continue
+            if isinstance(typ, str) and globalns is not None:
+                typ = _forward_ref(typ, globalns)
+            typ = _type_check(typ, "@overload: annotations must be types.")
+            if typ is Any or typ is object:
+                continue
+            checks[name] = (param.kind, typ, compile_checker(typ))
+        variant = (func, signature, checks)
+        for i, (_, other, _) in enumerate(self.variants):
+            if other == signature:
+                # Redefined, e.g. by reloading the module.
+                self.variants[i] = variant
+                break
+        else:
+            self.variants.append(variant)
+        self.table.clear()
+
+    def dispatch(self, args, kwargs):
+        """Return the variant to call; fill in the table if possible."""
+        token = abc.get_cache_token()
+        if token != self.token:
+            self.table.clear()
+            self.token = token
+        determined = True
+        for func, signature, checks in self.variants:
+            # Whether each variant applies must only depend on the
+            # argument types, up to and including the chosen one.
+            determined = determined and all(
+                _class_determined(_resolved(typ))
+                for _, typ, _ in checks.values())
+            try:
+                bound = signature.bind(*args, **kwargs)
+            except TypeError:
+                continue  # Wrong number or names of arguments.
+            if all(_bound_ok(bound.arguments[name], kind, check)
+                   for name, (kind, _, check) in checks.items()
+                   if name in bound.arguments):
+                if determined and not kwargs:
+                    types = tuple(map(type, args))
+                    self.table[tuple(map(id, types))] = (types, func)
+                return func
+        raise TypeError("%s(): no overload matches arguments of type (%s)" %
+                        (self.name,
+                         ', '.join([_type_repr(type(a)) for a in args] +
+                                   ['%s=%s' % (k, _type_repr(type(v)))
+                                    for k, v in kwargs.items()])))
+
+
+def _bound_ok(value, kind, check):
+    if kind is inspect.Parameter.VAR_POSITIONAL:
+        return all(map(check, value))
+    if kind is inspect.Parameter.VAR_KEYWORD:
+        return all(map(check, value.values()))
+    return check(value)
+
+
+def overload(func):
+    """Decorator for the variants of an overloaded function.
+
+    The variants defined under one name in the same namespace (a
+    module, class body or function call) make up one function, which
+    calls the first variant (in order of definition) whose annotated
+    parameters accept the arguments::
+
+      @overload
+      def area(shape: Circle) -> float:
+          return math.pi * shape.r ** 2
+
+      @overload
+      def area(shape: Tuple[float, float]) -> float:
+          return shape[0] * shape[1]
+
+    Each decoration returns a new dispatcher with the variants found
+    under the name in the namespace so far plus the new one, and
+    leaves dispatchers already returned alone.  A variant with the
+    same signature as an earlier one replaces it.
+
+    The variant chosen for a tuple of argument types is remembered if
+    the choice can't depend on anything else, i.e. the annotations
+    of the variants tried are classes, ABCs, Any or unions of those.
+    Then a later call with the same types costs a dict lookup on top
+    of the call.  Calls with keyword arguments, and those where e.g.
+    Tuple[...] annotations or type variables were involved, are
+    dispatched by trying the variants each time.
+    """
+    # The namespace the variant is being defined in.
+    existing = sys._getframe(1).f_locals.get(func.__name__)
+    previous = getattr(existing, '__overload__', None)
+    if (isinstance(previous, _Overload) and
+            previous.name == func.__qualname__):
+        state = _Overload(func.__qualname__, previous.variants)
+    else:
+        state = _Overload(func.__qualname__)
+    state.add(func)
+    table = state.table
+
+    @functools.wraps(func)
+    def overloaded(*args, **kwargs):
+        if not kwargs and state.token == abc.get_cache_token():
+            entry = table.get(tuple([id(type(a)) for a in args]))
+            if entry is not None:
+                return entry[1](*args)
+        return state.dispatch(args, kwargs)(*args, **kwargs)
+
+    overloaded.__overload__ = state
+    return overloaded
+
+
+_BATCH_CHUNK_SIZE = 1024
+
+
+def check_all(typ, iterable):
+    """Return whether isinstance(x, typ) holds for every x in iterable.
+
+    See first_violation() for how this avoids per-item overhead.
+    """
+    return first_violation(typ, iterable) is None
+
+
+def first_violation(typ, iterable):
+    """Return (index, item) for the first item not an instance of typ.
+
+    If all items are instances of typ, return None.
+
+    All decisions about typ are made once, up front: a checker is
+    compiled for it (see compile_checker()), or if typ is a class or
+    a union of classes the items are passed to isinstance() directly.
+    Items are then processed in chunks, each of which is tested in a
+    single all(map(...)) call, so the per-item cost is that of the
+    check itself.
+
+    For an array.array, or a NumPy array that doesn't hold Python
+    objects, all items have the same class.  If typ only looks at the
+    class of an object (e.g. a class, an ABC or a union of these) the
+    answer follows from the first item, and no other item is touched.
+    """
+    typ = _type_check(typ, "first_violation(t, iterable): t must be a type.")
+    if _homogeneous(iterable) and _class_determined(typ):
+        if not len(iterable) or isinstance(iterable[0], typ):
+            return None
+        return 0, iterable[0]
+    classinfo = _batch_classinfo(typ)
+    if classinfo is not None:
+        def all_ok(chunk, repeat=itertools.repeat(classinfo)):
+            return all(map(isinstance, chunk, repeat))
+        check = lambda x: isinstance(x, classinfo)
+    else:
+        check = compile_checker(typ)
+        all_ok = lambda chunk: all(map(check, chunk))
+    iterator = iter(iterable)
+    start = 0
+    while True:
+        chunk = list(itertools.islice(iterator, _BATCH_CHUNK_SIZE))
+        if not chunk:
+            return None
+        if not all_ok(chunk):
+            for i, x in enumerate(chunk, start):
+                if not check(x):
+                    return i, x
+        start += len(chunk)
+
+
+def _homogeneous(iterable):
+    """Return whether all items of iterable are known to share a class.
+
+    That is the case for array.array and for NumPy arrays whose
+    dtype isn't object (iterating over those yields NumPy scalars of
+    the dtype's type, or sub-arrays).
+    """
+    if isinstance(iterable, array.array):
+        return True
+    # Don't import NumPy; if it isn't loaded there are no arrays.
+    numpy = sys.modules.get('numpy')
+    return (numpy is not None and isinstance(iterable, numpy.ndarray) and
+            iterable.dtype.kind != 'O')
+
+
+def _class_determined(typ):
+    """Return whether isinstance(x, typ) only depends on type(x)."""
+    if isinstance(typ, UnionMeta) and typ.__union_params__ is not None:
+        return all(map(_class_determined, typ.__union_params__))
+    return (typ is Any or
+            (_type_determined(typ) and not isinstance(typ, TypeVar)))
+
+
+def _batch_classinfo(typ):
+    """Return a class or tuple of classes that can stand in for typ.
+
+    This is possible if typ is not a typing class, or a union of
+    such.  Otherwise return None.
+    """
+    if isinstance(typ, UnionMeta) and typ.__union_params__ is not None:
+        if any(isinstance(t, (TypingMeta, _TypeAlias))
+               for t in typ.__union_params__):
+            return None
+        return typ.__union_params__
+    if isinstance(typ, (TypingMeta, _TypeAlias)):
+        return None
+    return typ
+
+
+def checked_iter(typ, iterable, every=1):
+    """Return an iterator over iterable that checks items as they come.
+
+    typ is Iterator[X] or Iterable[X]; each item the returned iterator
+    produces is checked against X when it is consumed, and TypeError
+    is raised for the first one that isn't an instance.  Nothing is
+    read ahead or kept, so this works for generators of any length.
+
+    The check for X is prepared once, as for first_violation().  With
+    every=N only every Nth item is checked (the first, the N+1st, ...)
+    and the others are passed through without any per-item work, which
+    bounds the overhead to about 1/N of checking all of them.
+
+    If X accepts every object (e.g. Any or an unbound type variable)
+    this simply returns iter(iterable).
+    """
+    if (not isinstance(typ, GenericMeta) or
+            typ.__dict__.get('__extra__') not in (collections.abc.Iterable,
+                                                  collections.abc.Iterator)):
+        raise TypeError("checked_iter(t, iterable): t must be Iterator[X] "
+                        "or Iterable[X]; got %s" % _type_repr(typ))
+    if not isinstance(every, int) or every < 1:
+        raise ValueError("checked_iter(): every must be a positive int")
+    iterator = iter(iterable)
+    item_type = typ.__parameters__[0]
+    check = _item_check(item_type)
+    if check is None:
+        return iterator
+    items = _checked_items(iterator, check, item_type, every)
+    if every > 1:
+        items = itertools.chain.from_iterable(items)
+    return items
+
+
+def _item_check(t):
+    """Return a function doing isinstance(x, t), or None if all x pass.
+
+    The function is prepared once, as for first_violation().
+    """
+    t = _element_type(t)
+    if t is None:
+        return None
+    classinfo = _batch_classinfo(t)
+    if classinfo is not None:
+        return lambda x: isinstance(x, classinfo)
+    return compile_checker(t)
+
+
+def _checked_items(iterator, check, item_type, every):
+    """Generator behind checked_iter().
+
+    With every > 1 this yields a 1-tuple with a checked item followed
+    by an islice() over the next every - 1 items, to be flattened by
+    itertools.chain.from_iterable(); that way items that aren't
+    checked never pass through this generator.
+    """
+    index = 0
+    for item in iterator:
+        if not check(item):
+            raise TypeError("Item %d must be %s, got %s" %
+                            (index, _type_repr(item_type),
+                             _type_repr(type(item))))
+        if every == 1:
+            yield item
+        else:
+            yield (item,)
+            yield itertools.islice(iterator, every - 1)
+        index += every
+
+
+class _CheckedContainer:
+    """Base class of the checked container proxies.
+
+    A proxy wraps a container (a new empty one by default), checks its
+    contents against the type once when it is created, and from then
+    on only checks what is added through the proxy.  Changes made to
+    the wrapped container directly aren't checked.  Additions of
+    several items are checked in full before any is made.
+    """
+
+    __slots__ = ('__type__', '_data')
+
+    # The allowed extras of the type, the first one making empty data,
+    # and how to describe them.
+    _extras = ()
+    _expected = None
+
+    def __init__(self, typ, data=None):
+        if (not isinstance(typ, GenericMeta) or
+                typ.__dict__.get('__extra__') not in self._extras):
+            raise TypeError("%s(t, data): t must be %s; got %s" % (
+                self.__class__.__name__, self._expected, _type_repr(typ)))
+        self.__type__ = typ
+        self._data = self._extras[0]() if data is None else data
+        self._prepare(typ.__parameters__)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __contains__(self, value):
+        return value in self._data
+
+    def __eq__(self, other):
+        if isinstance(other, _CheckedContainer):
+            other = other._data
+        return self._data == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '%s(%s, %r)' % (self.__class__.__name__,
+                               _type_repr(self.__type__), self._data)
+
+
+def _check_item(check, value, what, item_type):
+    if check is not None and not check(value):
+        raise TypeError("%s must be %s, got %s" % (
+            what, _type_repr(item_type), _type_repr(type(value))))
+
+
+class CheckedList(_CheckedContainer, collections.abc.MutableSequence):
+    """A list proxy that only accepts items of a given type.
+
+        scores = CheckedList(List[int], [1, 2, 3])
+        scores.append(4)    # Only 4 is checked.
+        scores.append('')   # TypeError
+
+    The type is List[X] or MutableSequence[X].  See _CheckedContainer.
+    """
+
+    __slots__ = ('_check', '_item_type')
+    _extras = (list, collections.abc.MutableSequence)
+    _expected = 'List[X] or MutableSequence[X]'
+
+    def _prepare(self, params):
+        self._item_type = params[0]
+        self._check = _item_check(self._item_type)
+        for i, value in enumerate(self._data):
+            _check_item(self._check, value, 'Item %d' % i, self._item_type)
+
+    def __getitem__(self, index):
+        return self._data[index]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = list(value)
+            for item in value:
+                _check_item(self._check, item, 'Item', self._item_type)
+        else:
+            _check_item(self._check, value, 'Item', self._item_type)
+        self._data[index] = value
+
+    def __delitem__(self, index):
+        del self._data[index]
+
+    def insert(self, index, value):
+        _check_item(self._check, value, 'Item', self._item_type)
+        self._data.insert(index, value)
+
+    def append(self, value):
+        _check_item(self._check, value, 'Item', self._item_type)
+        self._data.append(value)
+
+    def extend(self, values):
+        values = list(values)
+        for value in values:
+            _check_item(self._check, value, 'Item', self._item_type)
+        self._data.extend(values)
+
+    def reverse(self):
+        self._data.reverse()
+
+
+class CheckedDict(_CheckedContainer, collections.abc.MutableMapping):
+    """A dict proxy that only accepts keys and values of given types.
+
+    The type is Dict[K, V] or MutableMapping[K, V].  See
+    _CheckedContainer.
+    """
+
+    __slots__ = ('_key_check', '_value_check', '_key_type', '_value_type')
+    _extras = (dict, collections.abc.MutableMapping)
+    _expected = 'Dict[K, V] or MutableMapping[K, V]'
+
+    def _prepare(self, params):
+        self._key_type, self._value_type = params
+        self._key_check = _item_check(self._key_type)
+        self._value_check = _item_check(self._value_type)
+        for key, value in self._data.items():
+            self._check_pair(key, value)
+
+    def _check_pair(self, key, value):
+        _check_item(self._key_check, key, 'Key', self._key_type)
+        _check_item(self._value_check, value, 'Value for key %r' % (key,),
+                    self._value_type)
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._check_pair(key, value)
+        self._data[key] = value
+
+    def __delitem__(self, key):
+        del self._data[key]
+
+    def update(self, *args, **kwargs):
+        items = dict(*args, **kwargs)
+        for key, value in items.items():
+            self._check_pair(key, value)
+        self._data.update(items)
+
+
+class CheckedSet(_CheckedContainer, collections.abc.MutableSet):
+    """A set proxy that only accepts items of a given type.
+
+    The type is Set[X] or MutableSet[X].  Set operations such as |
+    return plain sets.  See _CheckedContainer.
+    """
+
+    __slots__ = ('_check', '_item_type')
+    _extras = (set, collections.abc.MutableSet)
+    _expected = 'Set[X] or MutableSet[X]'
+
+    def _prepare(self, params):
+        self._item_type = params[0]
+        self._check = _item_check(self._item_type)
+        for value in self._data:
+            _check_item(self._check, value, 'Item', self._item_type)
+
+    def _from_iterable(self, values):
+        return set(values)
+
+    def add(self, value):
+        _check_item(self._check, value, 'Item', self._item_type)
+        self._data.add(value)
+
+    def discard(self, value):
+        self._data.discard(value)
+
+    def update(self, *iterables):
+        values = set().union(*iterables)
+        for value in values:
+            _check_item(self._check, value, 'Item', self._item_type)
+        self._data |= values
+
+    def __ior__(self, values):
+        self.update(values)
+        return self
+
+    def __ixor__(self, values):
+        if values is self:
+            self.clear()
+            return self
+        values = set(values)
+        for value in values:
+            if value not in self._data:
+                _check_item(self._check, value, 'Item', self._item_type)
+        self._data ^= values
+        return self
+
+
+def validate(typ, value):
+    """Check a value against a type, following shared and cyclic data.
+
+    This gives the same answer as isinstance(value, typ), but
+    isinstance() checks each occurrence of an object separately and
+    recurses without bound, so shared substructure is checked over
+    and over and cyclic data never finishes.  validate() walks the
+    value with an explicit stack, so deep data doesn't hit the
+    recursion limit, and remembers for the duration of the call the
+    result for each (object, type) pair it has checked.  A pair met
+    again while it is still being checked (a cycle) is assumed to
+    match; the results that relied on that are withdrawn if it turns
+    out not to.  Forward references are followed, so recursive types
+    such as
+
+        JSON = Union[int, str, List['JSON'], Dict[str, 'JSON']]
+
+    can be checked.  Which container elements are looked at follows
+    the validation setting, as for isinstance().
+    """
+    typ = _type_check(typ, "validate(t, value): t must be a type.")
+    while isinstance(typ, _ForwardRef):
+        typ = typ._resolve()
+    goal = _validation_goal(typ, value)
+    if goal is True or goal is False:
+        return goal
+    memo = {}  # {(id(object), id(type)): result}
+    # Keys of true results in memo that rely on a pair still being
+    # checked, in order of completion, and the frame they rely on.
+    tentative = []
+    pending = {}
+    frame = _ValidationFrame((id(value), id(typ)), goal, 0, 0)
+    stack = [frame]
+    active = {frame.key: frame}
+    result = None
+    while True:
+        frame = stack[-1]
+        if result is not frame.any_of:
+            result = None
+            for v, t in frame.goals:
+                while isinstance(t, _ForwardRef):
+                    t = t._resolve()
+                goal = _validation_goal(t, v)
+                dep = None
+                if goal is True or goal is False:
+                    r = goal  # Not worth remembering.
+                else:
+                    key = (id(v), id(t))
+                    r = memo.get(key)
+                    if r is None:
+                        dep = active.get(key)
+                        if dep is None:
+                            child = _ValidationFrame(key, goal, len(stack),
+                                                     len(tentative))
+                            stack.append(child)
+                            active[key] = child
+                            break
+                        r = True  # A cycle.
+                    elif r and key in pending:
+                        dep = pending[key]
+                        while dep.dep is not None:
+                            dep = dep.dep
+                if dep is not None and dep.index < frame.low:
+                    frame.low = dep.index
+                if r is frame.any_of:
+                    result = r
+                    break
+            else:
+                result = not frame.any_of
+            if result is None:
+                continue  # Check the child first.
+        # The frame is done.
+        stack.pop()
+        del active[frame.key]
+        if not result:
+            for key in tentative[frame.start:]:
+                del memo[key], pending[key]
+            del tentative[frame.start:]
+        elif frame.low == frame.index:
+            for key in tentative[frame.start:]:
+                del pending[key]
+            del tentative[frame.start:]
+        else:
+            frame.dep = stack[frame.low]
+            pending[frame.key] = frame.dep
+            tentative.append(frame.key)
+            stack[-1].low = min(stack[-1].low, frame.low)
+        if not stack:
+            return result
+        memo[frame.key] = result
+
+
+class _ValidationFrame:
+    """A (value, type) pair that validate() is checking.
+
+    The value matches any (if any_of) or all of the (value, type)
+    pairs in goals.  low is the lowest index in the stack of a pair
+    whose assumed result this one relies on so far; once done with a
+    true result, dep is the frame of that pair, if it isn't itself.
+    """
+
+    __slots__ = ('key', 'any_of', 'goals', 'index', 'start', 'low', 'dep')
+
+    def __init__(self, key, goal, index, start):
+        self.key = key
+        self.any_of, goals = goal
+        self.goals = iter(goals)
+        self.index = self.low = index
+        self.start = start
+        self.dep = None
+
+
+def _validation_goal(t, value):
+    """Helper for validate().
+
+    Return isinstance(value, t) if that doesn't involve checking
+    other objects against types, else (any_of, goals) where goals are
+    (object, type) pairs: value matches t if it matches any (if
+    any_of) or all of them.
+    """
+    if isinstance(t, UnionMeta) and t.__union_params__ is not None:
+        # Members that only look at the class are settled at once.
+        if isinstance(value, t.__union_cached_params__):
+            return True
+        if not t.__union_other_params__ and t.__union_dispatch__ is None:
+            return False
+        others = list(t.__union_other_params__)
+        if t.__union_dispatch__ is not None and isinstance(value, tuple):
+            others[:0] = t.__union_dispatch__.candidates(value)
+        return True, [(value, p) for p in others]
+    if isinstance(t, (TupleMeta, _TupleAlias)):
+        params = t.__tuple_params__
+        if params is None or not isinstance(value, tuple):
+            return isinstance(value, tuple)
+        if len(value) != len(params):
+            return False
+        return False, ((x, params[i]) for i, x in _checked_elements(value))
+    if isinstance(t, GenericMeta) and t.__element_params__ is not None:
+        if not super(GenericMeta, t).__instancecheck__(value):
+            return False
+        params = t.__element_params__
+        if len(params) == 2:
+            item_types = tuple(map(_element_type, params))
+            return False, ((x, item_type)
+                           for _, item in _checked_elements(value.items())
+                           for x, item_type in zip(item, item_types)
+                           if item_type is not None)
+        element_type = _element_type(params[0])
+        if element_type is None:
+            return True
+        return False, ((x, element_type) for _, x in _checked_elements(value))
+    return isinstance(value, t)
+
+
+# Instrumentation.  When enabled, the instance and subclass checks
+# of the classes below are replaced by wrappers that count calls and
+# time spent per type expression.  Disabling restores the original
+# methods, so there is no cost at all when instrumentation is off.
+
+_INSTRUMENTED_CLASSES = (AnyMeta, TypeVar, UnionMeta, TupleMeta,
+                         CallableMeta, GenericMeta, ProtocolMeta)
+_INSTRUMENTED_METHODS = ('__instancecheck__', '__subclasscheck__')
+
+_instrumentation_saved = None  # {(class, name): original dict entry}
+_instrumentation_stats = {}  # {(repr, method name): [calls, seconds]}
+_instrumentation_reprs = {}  # {id(type): (weakref to type, repr)}
+_NOT_IN_DICT = object()
+
+
+def _instrumented(name, method):
+    stats = _instrumentation_stats
+    reprs = _instrumentation_reprs
+    clock = time.perf_counter
+
+    def wrapper(self, arg):
+        t0 = clock()
+        try:
+            return method(self, arg)
+        finally:
+            elapsed = clock() - t0
+            cached = reprs.get(id(self))
+            if cached is None or cached[0]() is not self:
+                cached = weakref.ref(self), repr(self)
+                reprs[id(self)] = cached
+            entry = stats.get((cached[1], name))
+            if entry is None:
+                stats[cached[1], name] = [1, elapsed]
+            else:
+                entry[0] += 1
+                entry[1] += elapsed
+
+    wrapper.__name__ = name
+    wrapper.__qualname__ = getattr(method, '__qualname__', name)
+    wrapper.__wrapped__ = method
+    return wrapper
+
+
+def enable_instrumentation():
+    """Start counting instance and subclass checks per type.
+
+    This covers __instancecheck__() and __subclasscheck__() of Any,
+    type variables, Union, Tuple, Callable and generic classes.
+    Times are cumulative, i.e. they include nested checks (such as
+    those of a union's members).  Setting the environment variable
+    TYPING_INSTRUMENT to a non-empty value when this module is first
+    imported has the same effect.  See instrumentation_report().
+    """
+    global _instrumentation_saved
+    if _instrumentation_saved is not None:
+        return
+    saved = {}
+    for cls in _INSTRUMENTED_CLASSES:
+        for name in _INSTRUMENTED_METHODS:
+            saved[cls, name] = cls.__dict__.get(name, _NOT_IN_DICT)
+            setattr(cls, name, _instrumented(name, getattr(cls, name)))
+    _instrumentation_saved = saved
+
+
+def disable_instrumentation():
+    """Stop counting checks and restore the original methods.
+
+    The statistics collected so far are kept.
+    """
+    global _instrumentation_saved
+    if _instrumentation_saved is None:
+        return
+    for (cls, name), method in _instrumentation_saved.items():
+        if method is _NOT_IN_DICT:
+            delattr(cls, name)
+        else:
+            setattr(cls, name, method)
+    _instrumentation_saved = None
+
+
+def reset_instrumentation():
+    """Discard the statistics collected so far."""
+    _instrumentation_stats.clear()
+    _instrumentation_reprs.clear()
+
+
+def instrumentation_report(format='table'):
+    """Return the collected statistics, most expensive first.
+
+    With format='table' (the default) this returns a string with a
+    line per type expression and check; with format='json' a JSON
+    string holding a list of objects with the keys 'type', 'check'
+    ('instance' or 'subclass'), 'calls' and 'seconds'.
+    """
+    rows = sorted(((key, calls, seconds) for key, (calls, seconds)
+                   in list(_instrumentation_stats.items())),
+                  key=lambda row: row[2], reverse=True)
+    records = [{'type': typ, 'check': name[2:-7], 'calls': calls,
+                'seconds': seconds}
+               for (typ, name), calls, seconds in rows]
+    if format == 'json':
+        import json
+        return json.dumps(records, indent=2)
+    if format != 'table':
+        raise ValueError("format must be 'table' or 'json'")
+    lines = ['%12s %12s %10s  %-8s  %s' % ('calls', 'total (us)',
+                                           'per call', 'check', 'type')]
+    for r in records:
+        lines.append('%12d %12.1f %10.3f  %-8s  %s' % (
+            r['calls'], r['seconds'] * 1e6, r['seconds'] * 1e6 / r['calls'],
+            r['check'], r['type']))
+    return '\n'.join(lines)
+
+
+if os.environ.get('TYPING_INSTRUMENT'):
+    enable_instrumentation()